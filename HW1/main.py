@@ -1,3 +1,4 @@
+import os
 from model import Dishes, DishesID, DishesName, Meals, MealsID, MealsName
 from flask import Flask
 from flask_restful import Api
@@ -39,4 +40,5 @@ if __name__ == '__main__':
 
     print("running main.py")
     # run Flask app.   default part is 5000 (not needed because it is specified in Dockerfile)
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # the debugger and reloader only when FLASK_DEBUG is set, gunicorn (see gunicorn.conf.py) serves in production
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8000)), debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true'))
\ No newline at end of file
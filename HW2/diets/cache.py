@@ -0,0 +1,44 @@
+import logging
+import os
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+"""
+Caching of the GET responses by the reverse proxy:
+- GET responses of the cached resource families carry an ETag and "Cache-Control: s-maxage", so the proxy
+  keeps them for CACHE_MAX_AGE seconds while clients revalidate them with If-None-Match
+- the proxy asks for the version of the family (GET /family:version, answered with the collection ETag)
+  before each GET and puts it in its cache key. After a write every cached variant of the family (pages,
+  ?fields=, ?diet=, the items by ID and by name) has an old key, so the next GET fetches a fresh response.
+  The proxy keeps the version for a second, so reads do not reach the service while nothing changes
+"""
+
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", 5))
+
+
+def enableHttpCache(app, families):
+    """ Make the GET responses of app cacheable by the reverse proxy, keyed by the version of their collection
+    :param families: dictionary of the form {family:etag} where family is the first segment of the cached
+                     paths (e.g. /dishes), and etag the function returning the ETag of its current version
+    """
+
+    # the version of each family, which the reverse proxy puts in its cache keys
+    for family, etag in families.items():
+        app.add_url_rule(family + ":version", f"{family[1:]}_version", lambda etag=etag: ("", 204, {"ETag": etag()}))
+
+    @app.after_request
+    def cacheResponse(response):
+        family = "/" + request.path.split("/")[1].split(":")[0]  # /dishes:batch is in the /dishes family
+        if family not in families:
+            return response
+
+        if request.method == "GET":
+            if response.status_code == 200:
+                response.headers["Cache-Control"] = f"public, max-age=0, s-maxage={CACHE_MAX_AGE}"
+                if "ETag" not in response.headers:
+                    response.add_etag()
+                response.make_conditional(request)  # 304 if the client has this version
+
+        return response
+
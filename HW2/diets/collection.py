@@ -1,4 +1,26 @@
+import logging
+import os
+import re
 import pymongo
+from .database import IdAllocator, OncePerProcess, VersionCounter, getDatabase
+
+logger = logging.getLogger(__name__)
+
+# number of IDs a process reserves per round trip to the counters, 1 keeps the IDs in creation order
+ID_BLOCK_SIZE = int(os.environ.get("ID_BLOCK_SIZE", 1))
+
+
+def duplicateField(details):
+    """ Return the field of the unique index a duplicate key error is about
+    :param details: details of the DuplicateKeyError, or write error of a BulkWriteError
+    :return: the field (e.g. name or _id), None if the server does not tell
+    """
+
+    details = details or {}
+    if details.get("keyPattern"):
+        return next(iter(details["keyPattern"]))
+    match = re.search(r"index: (\w+?)_(?:-?1)? dup key", details.get("errmsg", ""))
+    return match.group(1) if match else None
 
 
 class DietCollection:
@@ -9,31 +31,46 @@ class DietCollection:
     """
 
     def __init__(self):
-        """ Initialize the connection to the MongoDB server and access the database
-        Extract the diets collection and find latest ID
+        """ Access the diets collection through the shared MongoDB client, without connecting yet
         """
 
-        client = pymongo.MongoClient("mongodb://mongo:27017/")   # Connect to the MongoDB server
-        db = client["nutrition"]                                 # Access the database
+        # IDs come from a counter shared by all processes, seeded on first use
+        self.ids = IdAllocator("diets", block=ID_BLOCK_SIZE)
+        self.setup = OncePerProcess(self.prepare)
+
+        # The version of the collection, incremented after every change, identifies its content in ETags
+        self.versions = VersionCounter("diets")
+
+    @property
+    def diets(self):
+        """ The "diets" collection, created by MongoDB on first use """
 
-        # Check if the "diets" collection exists, create it if it doesn't
-        if "diets" not in db.list_collection_names():
-            db.create_collection("diets")
+        self.setup.run()
+        return getDatabase()["diets"]
 
-        self.diets = db["diets"]    # Access the "diets" collection
+    def prepare(self):
+        """ Create the indexes of the collection and find latest ID, on first use in the process """
 
-        latest_diet_id = self.diets.find_one(sort=[("_id", -1)])
-        if latest_diet_id is not None:
-            self.opNum = latest_diet_id["_id"]
-        else:
-            self.opNum = 0
+        diets = getDatabase()["diets"]
+
+        # A unique index makes the lookups by name indexed, and lets insertions detect duplicates
+        diets.create_index("name", unique=True)
+
+        # The counter must be past the diet with the highest ID value
+        latest_diet_id = diets.find_one(sort=[("_id", -1)], projection={"_id": 1})
+        self.ids.seed(latest_diet_id["_id"] if latest_diet_id is not None else 0)
+
+    def etag(self):
+        """ Return the ETag of the current content of the collection """
+
+        return f'"diets-{self.versions.current()}"'
 
     def retrieveAllDiets(self):
         """ Retrieve all diets from the collection
         :return: list of all old in the collection, excluding the "ID" key
         """
 
-        print("DietCollection: retrieving all diets:")
+        logger.debug("DietCollection: retrieving all diets")
         diets_list = []
 
         cursor = self.diets.find()  # Retrieve all documents from the collection
@@ -42,7 +79,6 @@ class DietCollection:
             del diet_copy["_id"]
             diets_list.append(diet_copy)
 
-        print(diets_list)
         return diets_list
 
     def insertDiet(self, diet_name, cal, sodium, sugar):
@@ -51,27 +87,32 @@ class DietCollection:
         return: id of the new diet (key)
         """
 
-        # Check if diet with the same name already exists in the collection
-        existing_diet = self.diets.find_one({"name": diet_name})
-        if existing_diet:
-            print("Diet with name", diet_name, "already exists")  # Instructions are "Diet with <name> already exists", different to the screenshot, dont think it matters
-            return 0
-
-        self.opNum += 1  # increment latest operation number
+        # A diet with the same name already existing is detected by the unique index when inserting it,
+        # the ID allocated for it is then left unused
+        self.setup.run()  # the counter is seeded before the first ID is allocated
+        [id] = self.ids.allocate()  # allocate a new ID
 
         diet = {
             "name": diet_name,
             "cal": cal,
             "sodium": sodium,
             "sugar": sugar,
-            "_id": self.opNum,
+            "_id": id,
         }
 
         # Insert the new diet document into the collection
-        result = self.diets.insert_one(diet)
+        try:
+            result = self.diets.insert_one(diet)
+        except pymongo.errors.DuplicateKeyError as e:
+            if duplicateField(e.details) not in ("name", None):  # the ID is taken: the counter is behind the IDs
+                logger.error("DietCollection: ID %s of diet %s already used: %s", id, diet_name, e)
+                raise
+            logger.debug("Diet with name %s already exists", diet_name)  # Instructions are "Diet with <name> already exists", different to the screenshot, dont think it matters
+            return 0
+        self.versions.bump()
         if result.inserted_id:
-            print("Diet", diet_name, "was created successfully")
-        return self.opNum
+            logger.debug("Diet %s was created successfully", diet_name)
+        return id
 
     def findDietName(self, name):
         """ Find a diet by the name
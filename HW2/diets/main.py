@@ -1,7 +1,17 @@
-from .model import Diets, DietsName
+import logging
+import os
+from .cache import enableHttpCache
+from .database import ping
+from .model import Diets, DietsName, dietColl
+from .metrics import instrument, registry
 from flask import Flask
 from flask_restful import Api
 
+# Log at LOG_LEVEL (WARNING by default, so the per-request debug logging stays off in the hot path)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -14,10 +24,35 @@ api.add_resource(Diets, '/diets')
 # Associate the Resource /diet/name with the DietsName class
 api.add_resource(DietsName, '/diets/<string:name>')
 
+# Let the reverse proxy cache the GET responses under the version of their collection
+enableHttpCache(app, {'/diets': dietColl.etag})
+
+# Liveness: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return {"status": "ok"}, 200
+
+
+# Readiness: MongoDB answers, so the service can serve requests
+@app.route('/readyz')
+def readyz():
+    error = ping()
+    if error is not None:
+        logger.warning("Not ready, MongoDB does not answer: %s", error)
+        return {"status": "unavailable"}, 503
+    return {"status": "ok"}, 200
+
+
+# Expose /metrics: request counts and latencies per Resource class and method, Mongo command latencies
+# and the collection size
+instrument(app)
+registry.callback("collection_size", "Number of documents in each collection", ["collection"],
+                  lambda: {("diets",): dietColl.diets.estimated_document_count()})
+
 
 if __name__ == '__main__':
 
-    print("running main.py")
+    logger.info("running main.py")
 
     # run Flask app
     # app.run(host='0.0.0.0',port=5002, debug=True)
\ No newline at end of file
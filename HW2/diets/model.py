@@ -1,7 +1,12 @@
+import hashlib
+import json
+import logging
 from flask import request
 from flask_restful import Resource
 from .collection import DietCollection
 
+logger = logging.getLogger(__name__)
+
 """
 The resources are:
 - /diets                This is a collection class, containing all the old
@@ -11,6 +16,13 @@ The resources are:
 # create DietsCollection instance with global scope
 dietColl = DietCollection()
 
+
+def dietETag(diet):
+    """ Return the ETag of a diet, derived from its content """
+
+    return '"' + hashlib.sha1(json.dumps(diet, sort_keys=True).encode()).hexdigest() + '"'
+
+
 class Diets(Resource):
     """
     The Diets class implements the REST operations for the /diets resource
@@ -28,7 +40,11 @@ class Diets(Resource):
         :return: JSON object and the status code
         """
 
-        return dietColl.retrieveAllDiets(), 200
+        etag = dietColl.etag()
+        if request.if_none_match.contains_raw(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
+        return dietColl.retrieveAllDiets(), 200, {'ETag': etag}
 
     def post(self):
         """
@@ -37,12 +53,12 @@ class Diets(Resource):
         """
 
         if request.headers is None:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return "POST expects content type to be application/json", 415
 
         # if request content-type is not application/json
         if 'Content-Type' not in dict(request.headers).keys():
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return "POST expects content type to be application/json", 415
         else:
             if dict(request.headers)['Content-Type'] != "application/json":
@@ -51,7 +67,7 @@ class Diets(Resource):
         try:
             data = request.json
         except Exception as e:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return "POST expects content type to be application/json", 415
 
         # if body is not of type dict
@@ -87,6 +103,11 @@ class DietsName(Resource):
 
         (b, w) = dietColl.findDietName(name)
         if b:
-            return w, 200  # return the diet and status code 200 ok
+            # the diet did not change since the client got it, let it reuse its copy
+            etag = dietETag(w)
+            if request.if_none_match.contains_raw(etag):
+                return None, 304, {'ETag': etag}
+
+            return w, 200, {'ETag': etag}  # return the diet and status code 200 ok
         else:
             return f"Diet {name} not found", 404
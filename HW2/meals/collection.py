@@ -1,5 +1,53 @@
-import requests
+import logging
+import os
+import re
 import pymongo
+from .database import IdAllocator, OncePerProcess, VersionCounter, getDatabase
+from .nutrition import NutritionCache, SingleFlight, lookupNutrition, lookupNutritionBatch
+
+logger = logging.getLogger(__name__)
+
+# number of IDs a process reserves per round trip to the counters, 1 keeps the IDs in creation order
+ID_BLOCK_SIZE = int(os.environ.get("ID_BLOCK_SIZE", 1))
+
+
+def findPage(coll, query=None, after=0, limit=None, fields=None):
+    """ Find a page of documents in ID order, starting after a cursor through the ID index
+    :param coll: the MongoDB collection to read
+    :param query: filter on the documents, all documents if None
+    :param after: ID of the last document of the previous page, 0 for the first page
+    :param limit: maximum number of documents in the page, no limit if None
+    :param fields: list of the fields to return (ID is always returned), all fields if None
+    :return: list of documents and the cursor of the next page, None if this is the last page
+    """
+
+    # Leave out the internal Mongo ID in the database rather than in Python
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({field: 1 for field in fields}, ID=1)
+
+    cursor = coll.find(dict(query or {}, ID={"$gt": after}), projection).sort("ID", pymongo.ASCENDING)
+    if limit is None:
+        return list(cursor), None
+
+    # Read one document more than the page to know whether there is a next page
+    documents = list(cursor.limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+    return documents[:limit], documents[limit - 1]["ID"]
+
+
+def duplicateField(details):
+    """ Return the field of the unique index a duplicate key error is about
+    :param details: details of the DuplicateKeyError, or write error of a BulkWriteError
+    :return: the field (e.g. name or _id), None if the server does not tell
+    """
+
+    details = details or {}
+    if details.get("keyPattern"):
+        return next(iter(details["keyPattern"]))
+    match = re.search(r"index: (\w+?)_(?:-?1)? dup key", details.get("errmsg", ""))
+    return match.group(1) if match else None
 
 
 class DishCollection:
@@ -8,43 +56,67 @@ class DishCollection:
     and a value of the following: dish name, calories, size (default 100g), sodium, suger
     """
 
-    def __init__(self):
-        """ Initialize the connection to the MongoDB server and access the database
-        Extract the dishes collection and find latest ID
+    def __init__(self, provider=None):
+        """ Access the dishes collection through the shared MongoDB client, without connecting yet
+        :param provider: NutritionProvider used to look up new dishes, the default provider if None
         """
 
-        client = pymongo.MongoClient("mongodb://mongo:27017/")   # Connect to the MongoDB server
-        db = client["nutrition"]                                 # Access the database
+        self.provider = provider
+
+        # IDs come from a counter shared by all processes, seeded on first use
+        self.ids = IdAllocator("dishes", block=ID_BLOCK_SIZE)
+        self.setup = OncePerProcess(self.prepare)
+
+        # The version of the collection, incremented after every change, identifies its content in ETags
+        self.versions = VersionCounter("dishes")
+
+        # Coalesce concurrent insertions of the same normalized name into one lookup
+        self.inflight = SingleFlight()
+
+    @property
+    def dishes(self):
+        """ The "dishes" collection, created by MongoDB on first use """
+
+        self.setup.run()
+        return getDatabase()["dishes"]
+
+    def prepare(self):
+        """ Create the indexes of the collection and find latest ID, on first use in the process """
 
-        # Check if the "dishes" collection exists, create it if it doesn't
-        if "dishes" not in db.list_collection_names():
-            db.create_collection("dishes")
+        dishes = getDatabase()["dishes"]
 
-        self.dishes = db["dishes"]    # Access the "dishes" collection
+        # Unique indexes make the lookups by name and ID indexed, and let insertions detect duplicates
+        dishes.create_indexes([pymongo.IndexModel("name", unique=True), pymongo.IndexModel("ID", unique=True)])
 
-        # Extract the dish with the highest ID value (most recently inserted)
-        latest_dish_id = self.dishes.find_one(sort=[("ID", -1)])
-        if latest_dish_id is not None:
-            self.opNum = latest_dish_id["ID"]
-        else: # Initialize to 0 if there are no dishes
-            self.opNum = 0
+        # The counter must be past the dish with the highest ID value
+        latest_dish_id = dishes.find_one(sort=[("ID", -1)], projection={"ID": 1})
+        self.ids.seed(latest_dish_id["ID"] if latest_dish_id is not None else 0)
+
+    def etag(self):
+        """ Return the ETag of the current content of the collection """
+
+        return f'"dishes-{self.versions.current()}"'
 
     def retrieveAllDishes(self):
         """ Retrieve all dishes
         :return: list of all dishes in the collection
         """
 
-        print("DishCollection: retrieving all dishes:")
-        dishes_list = []
+        logger.debug("DishCollection: retrieving all dishes")
 
-        cursor = self.dishes.find()  # Retrieve all documents from the collection
-        for dish in cursor:
-            dish_copy = dish.copy()
-            del dish_copy["_id"] # Remove the internal Mongo ID
-            dishes_list.append(dish_copy)
+        return findPage(self.dishes)[0]
+
+    def retrieveDishes(self, after=0, limit=None, fields=None):
+        """ Retrieve a page of dishes in ID order
+        :param after: ID of the last dish of the previous page, 0 for the first page
+        :param limit: maximum number of dishes in the page, no limit if None
+        :param fields: list of the fields to return (ID is always returned), all fields if None
+        :return: list of the dishes and the cursor of the next page, None if this is the last page
+        """
 
-        print(dishes_list)
-        return dishes_list
+        logger.debug("DishCollection: retrieving dishes after ID %s", after)
+
+        return findPage(self.dishes, after=after, limit=limit, fields=fields)
 
     def insertDish(self, dish_name):
         """ Insert a new dish based on dish name, using API Ninja/Nutrition
@@ -52,57 +124,102 @@ class DishCollection:
         return: ID of the new dish
         """
 
-        # Check if dish with the same name already exists
-        dish_exists = self.dishes.find_one({"name": dish_name})
-        if dish_exists:
-            print("DishCollection: dish", dish_name, "already exists")
-            return -2
+        # A dish with the same name already existing is detected by the unique index when adding it
+        def lookupAndAdd():
+            # Look up the nutrition of the dish (cached, or through API Ninja/Nutrition)
+            code, totals = lookupNutrition(dish_name, self.provider)
+            if code != 0:  # -3 if not recognized by api/ninja, -4 if not reachable
+                return code, totals, code
+
+            return code, totals, self.addDish(dish_name, totals)
+
+        # Concurrent insertions of the same normalized name share one lookup. The first one adds
+        # its dish before the others resume, so those with the same name deterministically get -2
+        (code, totals, id), leader = self.inflight.do(NutritionCache.normalize(dish_name), lookupAndAdd)
+        if leader or code != 0:
+            return id
+
+        return self.addDish(dish_name, totals)
 
+    def addDish(self, dish_name, totals):
+        """ Add a dish whose nutrition was already looked up
+        param: dish_name and its nutrition totals
+        return: ID of the new dish, or -2 if a dish with the same name exists
+        """
+
+        # A dish with the same name already existing is detected by the unique index when adding it,
+        # the ID allocated for it is then left unused
+        [id] = self.ids.allocate()  # allocate a new ID
+
+        # Add dish to dish collection
+        dish = {
+            "name": dish_name,
+            "cal": totals["cal"],
+            "size": totals["size"],
+            "sodium": totals["sodium"],
+            "sugar": totals["sugar"],
+            "ID": id,
+            "_id": id
+        }
         try:
-            # Query API Ninja /nutrition
-            api_url = 'https://api.api-ninjas.com/v1/nutrition?query={}'.format(dish_name)
-            response = requests.get(api_url, headers={'X-Api-Key': '6zoIr+IoEg7H2GQGVDxw+g==WdtcKEIt1DOIoGKj'})
-
-            if response.status_code == requests.codes.ok:  # Check status code of response
-                dish_data = response.json()
-
-                # If dish not recognized by api/ninja
-                if not dish_data:
-                    print("Api Ninja/Nutrition does not recognize dish name:", dish_data)
-                    return -3
-
-                else:
-                    # Iterate over all dishes to accumulate components
-                    total_calories, total_sodium, total_sugar, total_serving_size = 0, 0, 0, 0
-                    for _dish in dish_data:
-                        total_calories += _dish["calories"]
-                        total_sodium += _dish["sodium_mg"]
-                        total_sugar += _dish["sugar_g"]
-                        total_serving_size += _dish["serving_size_g"]
-
-                    self.opNum += 1  # increment latest operation number
-
-                    # Add dish to dish collection
-                    dish = {
-                        "name": dish_name,
-                        "cal": total_calories,
-                        "size": total_serving_size,
-                        "sodium": total_sodium,
-                        "sugar": total_sugar,
-                        "ID": self.opNum,
-                        "_id": self.opNum
-                    }
-                    self.dishes.insert_one(dish)
-                    print("DishCollection: dish", dish_name, "was added")
-
-            else:
-                print(f"Api Ninja/Nutrition not reachable: {response.status_code}, {response.text}")
-                return -4
-        except Exception as e:
-            print(f"Api Ninja/Nutrition not reachable: {e}")
-            return -4
-
-        return self.opNum
+            self.dishes.insert_one(dish)
+        except pymongo.errors.DuplicateKeyError as e:
+            if duplicateField(e.details) not in ("name", None):  # the ID is taken: the counter is behind the IDs
+                logger.error("DishCollection: ID %s of dish %s already used: %s", id, dish_name, e)
+                raise
+            logger.debug("DishCollection: dish %s already exists", dish_name)
+            return -2
+        self.versions.bump()
+        logger.debug("DishCollection: dish %s was added", dish_name)
+
+        return id
+
+    def insertDishes(self, dish_names):
+        """ Insert several new dishes, looking up their nutrition concurrently
+        param: dish_names: list of dish names, repeated names are only inserted once
+        return: dictionary of the form {dish_name:ID} where ID is the new ID or an error code
+        """
+
+        unique_names = list(dict.fromkeys(dish_names))  # de-duplicate, keeping the request order
+
+        # Check which names already exist in one query
+        existing = {dish["name"] for dish in self.dishes.find({"name": {"$in": unique_names}}, {"name": 1})}
+        results = {dish_name: -2 for dish_name in existing}
+
+        # Resolve all new names concurrently
+        new_dishes = []
+        lookups = lookupNutritionBatch([dish_name for dish_name in unique_names if dish_name not in existing], self.provider)
+        for dish_name, (code, totals) in lookups.items():
+            if code != 0:  # -3 if not recognized by api/ninja, -4 if not reachable
+                results[dish_name] = code
+                continue
+
+            new_dishes.append({
+                "name": dish_name,
+                "cal": totals["cal"],
+                "size": totals["size"],
+                "sodium": totals["sodium"],
+                "sugar": totals["sugar"]
+            })
+
+        # Add all valid dishes in one round trip, with IDs allocated in one round trip
+        if new_dishes:
+            for dish, id in zip(new_dishes, self.ids.allocate(len(new_dishes))):
+                dish["ID"], dish["_id"] = id, id
+                results[dish["name"]] = id
+
+            try:
+                self.dishes.insert_many(new_dishes, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                for error in e.details["writeErrors"]:
+                    if duplicateField(error) not in ("name", None):  # the ID is taken: the counter is behind the IDs
+                        logger.error("DishCollection: could not add dishes: %s", error)
+                        raise
+                    results[new_dishes[error["index"]]["name"]] = -2  # added by another request in the meantime
+            self.versions.bump()
+            logger.debug("DishCollection: added %s dishes", len(new_dishes))
+
+        return {dish_name: results[dish_name] for dish_name in unique_names}
 
     def findDishID(self, id):
         """ Return a single BSON object of the dish specified by its ID
@@ -114,10 +231,10 @@ class DishCollection:
         if dish:
             dish_copy = dish.copy()
             del dish_copy["_id"]  # Remove the internal Mongo ID
-            print("DishCollection: found dish", dish_copy, "with ID", id)
+            logger.debug("DishCollection: found dish %s with ID %s", dish_copy, id)
             return True, dish_copy
 
-        print("DishCollection: did not find ID", id)
+        logger.debug("DishCollection: did not find ID %s", id)
         return False, None
 
     def findDishName(self, name):
@@ -130,10 +247,10 @@ class DishCollection:
         if dish:
             dish_copy = dish.copy()
             del dish_copy["_id"]  # Remove the internal Mongo ID
-            print("DishCollection: found dish", dish_copy, "with name", name)
+            logger.debug("DishCollection: found dish %s with name %s", dish_copy, name)
             return True, dish_copy
 
-        print("DishCollection: did not find name", name)
+        logger.debug("DishCollection: did not find name %s", name)
         return False, None
 
     def delDishID(self, id):
@@ -144,7 +261,8 @@ class DishCollection:
 
         result = self.dishes.delete_one({"ID": id})
         if result.deleted_count > 0:
-            print("DishCollection: deleted dish with ID", id)
+            self.versions.bump()
+            logger.debug("DishCollection: deleted dish with ID %s", id)
             return True, id
 
         return False, None
@@ -155,14 +273,11 @@ class DishCollection:
         :return: True if deleted, False if not found
         """
 
-        dish_to_delete = self.dishes.find_one({"name": name})
-
+        dish_to_delete = self.dishes.find_one_and_delete({"name": name}, projection={"ID": 1})
         if dish_to_delete:
-            dish_to_delete_id = dish_to_delete["ID"]
-            result = self.dishes.delete_one({"name": name})
-            if result.deleted_count > 0:
-                print("DishCollection: deleted dish with name", name)
-                return True, dish_to_delete_id
+            self.versions.bump()
+            logger.debug("DishCollection: deleted dish with name %s", name)
+            return True, dish_to_delete["ID"]
 
         return False, None
 
@@ -172,21 +287,35 @@ class DishCollection:
         :return: True or False depending on results
         """
 
-        dish_ids_that_exist = [dish['ID'] for dish in self.dishes.find()]  # Retrieve IDs of existing dishes
-        print(f"Dishes that exist: {dish_ids_that_exist}")
-        print(f"Dishes IDs needed to create: {list_of_ids}")
+        missing = self.findMissingDishes(list_of_ids)
+        logger.debug("All dishes exist: %s", not missing)
+        return not missing
 
-        exists = all(elem in dish_ids_that_exist for elem in list_of_ids)
-        print(f"All dishes exist: {exists}")
-        return exists
+    def findMissingDishes(self, list_of_ids):
+        """ Find which IDs in a list do not exist in dishes, with one indexed query
+        :params: list of dish IDs
+        :return: list of the IDs that do not exist
+        """
 
-    def extract_value(self, id, field):
-        """ Given the ID of a dish and the field to extract, return the value """
+        cursor = self.dishes.find({"ID": {"$in": list(list_of_ids)}}, {"ID": 1, "_id": 0})
+        existing = {dish["ID"] for dish in cursor}
+        return [id for id in list_of_ids if id not in existing]
 
-        dish = self.dishes.find_one({"ID": id})  # Retrieve the dish document with the specified ID
-        if dish:
-            return dish.get(field)  # Return the value of the specified field
-        return None
+    def sumDishes(self, list_of_ids):
+        """ Sum the calories, sodium and sugar of a list of dishes, fetched with one indexed query
+        :params: list of dish IDs (a dish listed twice is counted twice)
+        :return: dictionary of the totals: cal, sodium, sugar, None if one of the dishes does not exist
+        """
+
+        projection = {"ID": 1, "cal": 1, "sodium": 1, "sugar": 1, "_id": 0}
+        dishes = {dish["ID"]: dish for dish in self.dishes.find({"ID": {"$in": list(list_of_ids)}}, projection)}
+        if any(id not in dishes for id in list_of_ids):  # deleted since the caller checked it
+            return None
+
+        return {
+            field: sum(dishes[id][field] for id in list_of_ids)
+            for field in ["cal", "sodium", "sugar"]
+        }
 
 
 class MealCollection:
@@ -196,115 +325,143 @@ class MealCollection:
     """
 
     def __init__(self):
-        """ Initialize the connection to the MongoDB server and access the database
-        Extract the meals collection and find latest ID
+        """ Access the meals collection through the shared MongoDB client, without connecting yet
         """
 
-        client = pymongo.MongoClient("mongodb://mongo:27017/")  # Connect to the MongoDB server
-        db = client["nutrition"]  # Access the database
+        # IDs come from a counter shared by all processes, seeded on first use
+        self.ids = IdAllocator("meals", block=ID_BLOCK_SIZE)
+        self.setup = OncePerProcess(self.prepare)
+
+        # The version of the collection, incremented after every change, identifies its content in ETags
+        self.versions = VersionCounter("meals")
+
+    @property
+    def meals(self):
+        """ The "meals" collection, created by MongoDB on first use """
+
+        self.setup.run()
+        return getDatabase()["meals"]
 
-        # Check if the "meals" collection exists, create it if it doesn't
-        if "meals" not in db.list_collection_names():
-            db.create_collection("meals")
+    def prepare(self):
+        """ Create the indexes of the collection and find latest ID, on first use in the process """
 
-        self.meals = db["meals"]  # Access the "meals" collection
+        meals = getDatabase()["meals"]
 
-        # Extract the meal with the highest ID value (most recently inserted)
-        latest_meal_id = self.meals.find_one(sort=[("ID", -1)])
-        if latest_meal_id is not None:
-            self.opNum = latest_meal_id["ID"]
-        else:  # Initialize to 0 if there are no meals
-            self.opNum = 0
+        meals.create_indexes([
+            # Unique indexes make the lookups by name and ID indexed, and let insertions detect duplicates
+            pymongo.IndexModel("name", unique=True),
+            pymongo.IndexModel("ID", unique=True),
+
+            # Index the course slots so that the meals referencing a deleted dish are found without a scan
+            pymongo.IndexModel("appetizer"),
+            pymongo.IndexModel("main"),
+            pymongo.IndexModel("dessert"),
+
+            # Index the components so that the meals satisfying a diet are found without a scan
+            pymongo.IndexModel([("cal", pymongo.ASCENDING), ("sodium", pymongo.ASCENDING), ("sugar", pymongo.ASCENDING)]),
+        ])
+
+        # The counter must be past the meal with the highest ID value
+        latest_meal_id = meals.find_one(sort=[("ID", -1)], projection={"ID": 1})
+        self.ids.seed(latest_meal_id["ID"] if latest_meal_id is not None else 0)
+
+    def etag(self):
+        """ Return the ETag of the current content of the collection """
+
+        return f'"meals-{self.versions.current()}"'
 
     def retrieveAllMeals(self):
         """ Retrieve all dicts containing meals
         :return: list of all meals in the collection
         """
 
-        print("MealCollection: retrieving all meals:")
+        logger.debug("MealCollection: retrieving all meals")
 
-        meals_list = []
-        cursor = self.meals.find()  # Retrieve all documents from the collection
-        for meal in cursor:
-            meal_copy = meal.copy()
-            del meal_copy["_id"]  # Remove internal Mongo ID
-            meals_list.append(meal_copy)
+        return findPage(self.meals)[0]
+
+    def retrieveMeals(self, after=0, limit=None, fields=None):
+        """ Retrieve a page of meals in ID order
+        :param after: ID of the last meal of the previous page, 0 for the first page
+        :param limit: maximum number of meals in the page, no limit if None
+        :param fields: list of the fields to return (ID is always returned), all fields if None
+        :return: list of the meals and the cursor of the next page, None if this is the last page
+        """
+
+        logger.debug("MealCollection: retrieving meals after ID %s", after)
 
-        print(meals_list)
-        return meals_list
+        return findPage(self.meals, after=after, limit=limit, fields=fields)
+
+    def retrieveDietMeals(self, diet, after=0, limit=None, fields=None):
+        """ Retrieve a page of the meals satisfying a diet in ID order, filtered by the database
+        :param diet: the diet, with the maximum cal, sodium and sugar of a meal
+        :param after: ID of the last meal of the previous page, 0 for the first page
+        :param limit: maximum number of meals in the page, no limit if None
+        :param fields: list of the fields to return (ID is always returned), all fields if None
+        :return: list of the meals and the cursor of the next page, None if this is the last page
+        """
+
+        logger.debug("MealCollection: retrieving meals of diet %s after ID %s", diet["name"], after)
+
+        # $lte never matches null, so the meals with a deleted dish are left out
+        query = {field: {"$lte": diet[field]} for field in ["cal", "sodium", "sugar"]}
+        return findPage(self.meals, query, after, limit, fields)
 
     def updateMeals(self, dish_id):
-        """ Given a dish_id, update the meals
+        """ Given a dish_id, update the meals that reference it
         :param dish_id: dish ID being deleted
         """
 
-        cursor = self.meals.find()  # Retrieve all documents from the collection
-        for meal in cursor:
-            delete_components = False
-
-            # null out the dish ID that was deleted and associated with the meal
-            if dish_id == meal["appetizer"]:
-                meal["appetizer"] = None
-                delete_components = True
-            if dish_id == meal["main"]:
-                meal["main"] = None
-                delete_components = True
-            if dish_id == meal["dessert"]:
-                meal["dessert"] = None
-                delete_components = True
-
-            if delete_components: # if a dish was deleted, null out the components
-                meal["cal"], meal["sodium"], meal["sugar"] = None, None, None
-                self.meals.update_one({'_id': meal['_id']}, {'$set': meal})
+        # null out the dish ID that was deleted and the components of the meal, for each course
+        # slot referencing it, server-side and in a single round trip
+        updates = [
+            pymongo.UpdateMany({course: dish_id}, {"$set": {course: None, "cal": None, "sodium": None, "sugar": None}})
+            for course in ["appetizer", "main", "dessert"]
+        ]
+        result = self.meals.bulk_write(updates, ordered=False)
+        if result.modified_count > 0:
+            self.versions.bump()
+        logger.debug("MealCollection: updated %s meals referencing dish %s", result.modified_count, dish_id)
 
     def insertMeal(self, meal_name, appetizer_id, main_id, dessert_id, disheColl):
         """ Insert a meal given the name and the corresponding dish IDs. To create a meal, it
         computes the total number of calories, sodium, sugar.
         :param: meal name and component dish IDs
-        :returns: the ID of the created meal
+        :returns: the ID of the created meal, -2 if the name exists, -6 if one of the dishes was deleted meanwhile
         """
 
-        # Check if dish with the same name already exists
-        meal_exists = self.meals.find_one({"name": meal_name})
-        if meal_exists:
-            print("MealCollection: meal", meal_name, "already exists")
-            return -2
+        # Sum the components of the three dishes, fetched in one round trip
+        totals = disheColl.sumDishes([appetizer_id, main_id, dessert_id])
+        if totals is None:
+            logger.debug("MealCollection: a dish of meal %s was deleted", meal_name)
+            return -6
 
-        self.opNum += 1  # increment latest operation number
+        # A meal with the same name already existing is detected by the unique index when inserting it,
+        # the ID allocated for it is then left unused
+        [id] = self.ids.allocate()  # allocate a new ID
 
         meal = {
             "name": meal_name,
             "appetizer": appetizer_id,
             "main": main_id,
             "dessert": dessert_id,
-            "cal": sum(
-                cal for cal in [
-                    disheColl.extract_value(id=appetizer_id, field="cal"),
-                    disheColl.extract_value(id=main_id, field="cal"),
-                    disheColl.extract_value(id=dessert_id, field="cal")
-                ]
-            ),
-            "sodium": sum(
-                sodium for sodium in [
-                    disheColl.extract_value(id=appetizer_id, field="sodium"),
-                    disheColl.extract_value(id=main_id, field="sodium"),
-                    disheColl.extract_value(id=dessert_id, field="sodium")
-                ]
-            ),
-            "sugar": sum(
-                sugar for sugar in [
-                    disheColl.extract_value(id=appetizer_id, field="sugar"),
-                    disheColl.extract_value(id=main_id, field="sugar"),
-                    disheColl.extract_value(id=dessert_id, field="sugar")
-                ]
-            ),
-            "ID": self.opNum,
-            "_id": self.opNum,
+            "cal": totals["cal"],
+            "sodium": totals["sodium"],
+            "sugar": totals["sugar"],
+            "ID": id,
+            "_id": id,
         }
-        self.meals.insert_one(meal)
-        print("MealCollection: meal ", meal_name, " was added")
+        try:
+            self.meals.insert_one(meal)
+        except pymongo.errors.DuplicateKeyError as e:
+            if duplicateField(e.details) not in ("name", None):  # the ID is taken: the counter is behind the IDs
+                logger.error("MealCollection: ID %s of meal %s already used: %s", id, meal_name, e)
+                raise
+            logger.debug("MealCollection: meal %s already exists", meal_name)
+            return -2
+        self.versions.bump()
+        logger.debug("MealCollection: meal %s was added", meal_name)
 
-        return self.opNum
+        return id
 
     def delMealID(self, id):
         """ Given a meal ID, delete it from the collection
@@ -312,9 +469,10 @@ class MealCollection:
         :returns: True if successfully deleted, False if not found
         """
 
-        result = self.meals.delete_one({"ID": id})
-        if result.deleted_count > 0:
-            print("MealCollection: deleted meal with id ", id)
+        deleted_meal = self.meals.find_one_and_delete({"ID": id})
+        if deleted_meal:
+            self.versions.bump()
+            logger.debug("MealCollection: deleted meal with id %s", id)
             return True, id
 
         return False, None  # the key does not exist in the collection
@@ -325,14 +483,11 @@ class MealCollection:
         :returns: True if successfully deleted (and its ID), False if not
         """
 
-        meal_to_delete = self.meals.find_one({"name": name})
-
+        meal_to_delete = self.meals.find_one_and_delete({"name": name})
         if meal_to_delete:
-            meal_to_delete_id = meal_to_delete["ID"]
-            result = self.meals.delete_one({"name": name})
-            if result.deleted_count > 0:
-                print("MealCollection: deleted meal with name", name)
-                return True, meal_to_delete_id
+            self.versions.bump()
+            logger.debug("MealCollection: deleted meal with name %s", name)
+            return True, meal_to_delete["ID"]
 
         return False, None  # the key does not exist in the collection
 
@@ -346,10 +501,10 @@ class MealCollection:
         if meal:
             meal_copy = meal.copy()
             del meal_copy["_id"]  # Remove the internal Mongo ID
-            print("MealCollection: found dish", meal_copy, "with ID", id)
+            logger.debug("MealCollection: found dish %s with ID %s", meal_copy, id)
             return True, meal_copy
 
-        print("DishCollection: did not find ID", id)
+        logger.debug("DishCollection: did not find ID %s", id)
         return False, None
 
     def findMealName(self, name):
@@ -362,61 +517,47 @@ class MealCollection:
         if meal:
             meal_copy = meal.copy()
             del meal_copy["_id"]  # Remove the internal Mongo ID
-            print("MealCollection: found dish", meal_copy, "with name", name)
+            logger.debug("MealCollection: found dish %s with name %s", meal_copy, name)
             return True, meal_copy
 
-        print("MealCollection: did not find name", name)
+        logger.debug("MealCollection: did not find name %s", name)
         return False, None
 
     def replaceMeal(self, id, meal_name, appetizer_id, main_id, dessert_id, disheColl):
         """ Given a meal ID, replaces the meal components with the new meal name and component IDs
         :params: ID of meal to replace and new components (name and IDs)
-        :returns: True if updated, False if meal was not in collection
+        :returns: True if updated, False if meal was not in collection (-2 if another meal has the new name,
+                  -6 if one of the dishes was deleted meanwhile)
         """
 
-        cursor = self.meals.find()  # Retrieve all documents from the collection
-        for meal in cursor:
-            if id == meal["ID"]:
-
-                # Delete old meal
-                self.meals.delete_one({"ID": id})
-
-                updated_meal = {
-                    "name": meal_name,
-                    "appetizer": appetizer_id,
-                    "main": main_id,
-                    "dessert": dessert_id,
-                    "cal": sum(
-                        cal for cal in [
-                            disheColl.extract_value(id=appetizer_id, field="cal"),
-                            disheColl.extract_value(id=main_id, field="cal"),
-                            disheColl.extract_value(id=dessert_id, field="cal")
-                        ]
-                    ),
-                    "sodium": sum(
-                        sodium for sodium in [
-                            disheColl.extract_value(id=appetizer_id, field="sodium"),
-                            disheColl.extract_value(id=main_id, field="sodium"),
-                            disheColl.extract_value(id=dessert_id, field="sodium")
-                        ]
-                    ),
-                    "sugar": sum(
-                        sugar for sugar in [
-                            disheColl.extract_value(id=appetizer_id, field="sugar"),
-                            disheColl.extract_value(id=main_id, field="sugar"),
-                            disheColl.extract_value(id=dessert_id, field="sugar")
-                        ]
-                    ),
-                    "ID": id,
-                    "_id": id,
-                }
-
-                # Replace with updated meal
-                self.meals.insert_one(updated_meal)
-
-                print(f"MealCollection: meal {meal_name} with ID={id} was updated")
-                return True, id
-
-        # the key does not exist in the collection
-        print("MealCollection: did not find id", id)
-        return False, None
+        # Sum the components of the three dishes, fetched in one round trip
+        totals = disheColl.sumDishes([appetizer_id, main_id, dessert_id])
+        if totals is None:
+            logger.debug("MealCollection: a dish of meal %s was deleted", meal_name)
+            return False, -6
+
+        updated_meal = {
+            "name": meal_name,
+            "appetizer": appetizer_id,
+            "main": main_id,
+            "dessert": dessert_id,
+            "cal": totals["cal"],
+            "sodium": totals["sodium"],
+            "sugar": totals["sugar"],
+            "ID": id,
+        }
+
+        # Replace the meal in place through the ID index (keeping its _id), so readers never miss it
+        try:
+            old_meal = self.meals.find_one_and_replace({"ID": id}, updated_meal, projection={"_id": 1})
+        except pymongo.errors.DuplicateKeyError:  # another meal has the new name, the old one is kept
+            logger.debug("MealCollection: meal %s already exists", meal_name)
+            return False, -2
+
+        if old_meal is None:  # the key does not exist in the collection
+            logger.debug("MealCollection: did not find id %s", id)
+            return False, None
+
+        self.versions.bump()
+        logger.debug("MealCollection: meal %s with ID=%s was updated", meal_name, id)
+        return True, id
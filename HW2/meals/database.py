@@ -0,0 +1,221 @@
+import logging
+import os
+import threading
+import pymongo
+from .metrics import UPSTREAM_LATENCY
+
+logger = logging.getLogger(__name__)
+
+"""
+One MongoClient per process, shared by the collections and configured from the environment:
+- MONGO_URI and MONGO_DB select the server and the database
+- MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE size the connection pool
+- MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS bound the waits
+- MONGO_WRITE_CONCERN (e.g. 1 or majority) and MONGO_READ_PREFERENCE (e.g. primaryPreferred)
+The client connects on its first operation, and a new one is created after a fork.
+
+IDs are allocated from the "counters" collection, so that several processes never hand out the same ID,
+and the versions of the collections are kept there too, so that all processes agree on them.
+The indexes of a collection are created and its counter seeded on its first use in each process, not on import,
+so that a process starts without waiting for MongoDB.
+"""
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://mongo:27017/")
+MONGO_DB = os.environ.get("MONGO_DB", "nutrition")
+
+# client options and the environment variables they are read from
+CLIENT_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "w": ("MONGO_WRITE_CONCERN", lambda w: int(w) if w.isdigit() else w),
+    "readPreference": ("MONGO_READ_PREFERENCE", str),
+}
+
+
+class MongoCommandListener(pymongo.monitoring.CommandListener):
+    """ Records the latency of every MongoDB command as an upstream metric """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        UPSTREAM_LATENCY.observe(event.duration_micros / 1e6, upstream="mongo", operation=event.command_name)
+
+    def failed(self, event):
+        UPSTREAM_LATENCY.observe(event.duration_micros / 1e6, upstream="mongo", operation=event.command_name)
+
+
+def clientOptions():
+    """ Return the client options set in the environment """
+
+    options = {}
+    for option, (variable, parse) in CLIENT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
+_client, _client_pid = None, None
+_lock = threading.Lock()
+
+
+def getClient():
+    """ Return the MongoClient of the process, creating it on first use
+    :return: the shared MongoClient
+    """
+
+    global _client, _client_pid
+
+    with _lock:
+        # a client must not be used across a fork, the child process creates its own
+        if _client is None or _client_pid != os.getpid():
+            options = clientOptions()
+            logger.info("Creating MongoDB client for %s with %s", MONGO_URI, options)
+            _client = pymongo.MongoClient(MONGO_URI, connect=False, event_listeners=[MongoCommandListener()], **options)
+            _client_pid = os.getpid()
+        return _client
+
+
+def getDatabase():
+    """ Return the database of the service, through the shared MongoClient """
+
+    return getClient()[MONGO_DB]
+
+
+def ping():
+    """ Check that MongoDB answers, within the server selection timeout
+    :return: None if it answers, the error otherwise
+    """
+
+    try:
+        getClient().admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        return e
+    return None
+
+
+class OncePerProcess:
+    """ OncePerProcess runs a preparation step (e.g. creating the indexes of a collection) on first use,
+        once in each process. A step that fails is run again on the next use.
+    """
+
+    def __init__(self, step):
+        """ Initialize the runner
+        :param step: function without arguments to run once
+        """
+
+        self.step = step
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        """ Run the step if it did not complete in this process yet """
+
+        if self.pid == os.getpid():  # already done, without taking the lock
+            return
+
+        with self.lock:
+            if self.pid != os.getpid():  # not done by another thread meanwhile
+                self.step()
+                self.pid = os.getpid()
+
+
+class IdAllocator:
+    """ IdAllocator hands out unique IDs for a collection from a counter shared by all processes
+        Each counter is a document of the "counters" collection with the collection name as _id,
+        and a value of the following: the last ID allocated
+        IDs are reserved with an atomic $inc, block IDs at a time. With a block larger than 1 a process
+        hands out its reserved IDs locally, so IDs stay unique but are not in creation order across processes
+    """
+
+    def __init__(self, name, block=1):
+        """ Initialize the allocator of a collection
+        :param name: name of the collection the IDs are for
+        :param block: number of IDs reserved per round trip to MongoDB
+        """
+
+        self.name = name
+        self.block = block
+
+        # IDs reserved by this process and not handed out yet
+        self.next_id, self.last_id, self.pid = 1, 0, os.getpid()
+        self.lock = threading.Lock()
+
+    @property
+    def counters(self):
+        """ The "counters" collection, created by MongoDB on first use """
+
+        return getDatabase()["counters"]
+
+    def seed(self, latest_id):
+        """ Make sure the counter is past the IDs already used, e.g. by a collection created before the counter
+        :param latest_id: highest ID in the collection
+        """
+
+        self.counters.update_one({"_id": self.name}, {"$max": {"value": latest_id}}, upsert=True)
+
+    def reserve(self, count):
+        """ Reserve count IDs in one round trip
+        :return: the first and the last ID reserved
+        """
+
+        counter = self.counters.find_one_and_update(
+            {"_id": self.name}, {"$inc": {"value": count}}, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        return counter["value"] - count + 1, counter["value"]
+
+    def allocate(self, count=1):
+        """ Allocate new IDs
+        :param count: number of IDs to allocate
+        :return: list of the IDs
+        """
+
+        with self.lock:
+            # IDs reserved before a fork belong to the parent process
+            if self.pid != os.getpid():
+                self.next_id, self.last_id, self.pid = 1, 0, os.getpid()
+
+            # hand out the reserved IDs, reserving a new block once they are used up
+            if self.last_id - self.next_id + 1 < count:
+                if count > self.block:  # a large batch gets its own reservation
+                    first, last = self.reserve(count)
+                    return list(range(first, last + 1))
+                self.next_id, self.last_id = self.reserve(self.block)
+
+            ids = list(range(self.next_id, self.next_id + count))
+            self.next_id += count
+            return ids
+
+
+class VersionCounter:
+    """ VersionCounter keeps the version of a collection, incremented by every change to it
+        The version is stored in the document of the collection in the "counters" collection,
+        so that it is shared by all processes. It identifies the content of the collection in ETags.
+    """
+
+    def __init__(self, name):
+        """ Initialize the version counter of a collection
+        :param name: name of the collection
+        """
+
+        self.name = name
+
+    @property
+    def counters(self):
+        """ The "counters" collection, created by MongoDB on first use """
+
+        return getDatabase()["counters"]
+
+    def bump(self):
+        """ Increment the version, after the collection was changed """
+
+        self.counters.update_one({"_id": self.name}, {"$inc": {"version": 1}}, upsert=True)
+
+    def current(self):
+        """ Return the current version, with one lookup by _id """
+
+        counter = self.counters.find_one({"_id": self.name}, {"version": 1})
+        return counter.get("version", 0) if counter is not None else 0
@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import UPSTREAM_LATENCY
+from .nutrition import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DIETS_URL = os.environ.get("DIETS_URL", "http://diets-service:5002")
+
+
+class DietClient:
+    """ DietClient fetches diets from diets-service over a shared keep-alive connection pool and caches them
+        Each entry is stored in an ordered dictionary (least recently used first) with the diet name
+        as key, and a value of the following: expiry time, ETag, diet (None if the diet was not found)
+        Expired diets are revalidated with If-None-Match, and a 304 renews them without a body.
+        Diets not found are cached for a shorter time, so a new diet is visible soon after its POST.
+    """
+
+    def __init__(self, url=DIETS_URL, ttl=60, negative_ttl=5, maxsize=1024, pool_size=10,
+                 connect_timeout=1, read_timeout=5):
+        """ Initialize an empty cache and mount a connection pool for diets-service
+        :param url: base URL of diets-service
+        :param ttl: number of seconds a diet is used before it is revalidated
+        :param negative_ttl: number of seconds a diet not found stays not found
+        :param maxsize: maximum number of entries before the least recently used is evicted
+        :param pool_size: maximum number of keep-alive connections to diets-service
+        :param connect_timeout: seconds to wait for the TCP connection
+        :param read_timeout: seconds to wait for the response
+        """
+
+        self.url = url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self.hits, self.misses, self.revalidations = 0, 0, 0
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # concurrent lookups of the same diet share one request
+        self.inflight = SingleFlight()
+
+    def findDiet(self, name):
+        """ Find a diet by its name, from the cache or diets-service
+        :param name: the name of the diet
+        :return: True and the diet if found, False and None if not
+        :raises: requests.RequestException if diets-service could not be reached or failed, and nothing is cached
+        """
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(name)  # mark as most recently used
+                self.hits += 1
+                diet = entry[2]
+                return diet is not None, diet
+
+        diet, _ = self.inflight.do(name, lambda: self.fetch(name, entry))
+        return diet is not None, diet
+
+    def fetch(self, name, entry):
+        """ Get a diet from diets-service, revalidating the expired entry if there is one
+        :param name: the name of the diet
+        :param entry: the expired entry of the diet, None if not cached
+        :return: the diet, None if not found
+        :raises: requests.RequestException if diets-service could not be reached or failed, and entry is None
+        """
+
+        headers = {}
+        if entry is not None and entry[1] is not None:
+            headers["If-None-Match"] = entry[1]
+
+        try:
+            with UPSTREAM_LATENCY.time(upstream="diets-service", operation="get_diet"):
+                response = self.session.get(f"{self.url}/diets/{quote(name, safe='')}", headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if entry is None:
+                raise
+            logger.warning("DietClient: serving stale diet %s, diets-service not reachable: %s", name, e)
+            return entry[2]
+
+        if response.status_code == 304:  # unchanged, renew the cached diet
+            self.store(name, entry[1], entry[2], revalidated=True)
+            return entry[2]
+
+        if response.status_code == 200:
+            diet = response.json()
+            self.store(name, response.headers.get("ETag"), diet)
+            return diet
+
+        if response.status_code == 404:
+            self.store(name, None, None)
+            return None
+
+        # any other answer (e.g. 5xx) is not cached, and only a 404 means the diet does not exist
+        if entry is not None:
+            logger.warning("DietClient: serving stale diet %s, diets-service returned %s", name, response.status_code)
+            return entry[2]
+        logger.warning("DietClient: diets-service returned %s for diet %s", response.status_code, name)
+        raise requests.HTTPError(f"diets-service returned {response.status_code} for diet {name}", response=response)
+
+    def store(self, name, etag, diet, revalidated=False):
+        """ Store a diet (None if not found), evicting the least recently used entries if full """
+
+        ttl = self.ttl if diet is not None else self.negative_ttl
+        with self.lock:
+            if revalidated:
+                self.revalidations += 1
+            else:
+                self.misses += 1
+            self.entries[name] = (time.time() + ttl, etag, diet)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """ Return the cache counters and size """
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "revalidations": self.revalidations, "size": len(self.entries)}
+
+
+# create DietClient instance with global scope, configured from the environment
+diet_client = DietClient(
+    ttl=float(os.environ.get("DIET_CACHE_TTL", 60)),
+    negative_ttl=float(os.environ.get("DIET_CACHE_NEGATIVE_TTL", 5)),
+    maxsize=int(os.environ.get("DIET_CACHE_SIZE", 1024)),
+    pool_size=int(os.environ.get("DIETS_POOL_SIZE", 10))
+)
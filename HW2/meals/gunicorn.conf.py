@@ -0,0 +1,31 @@
+import os
+
+"""
+gunicorn configuration of the meals service, read from the environment:
+- PORT (default 5001) to listen on
+- GUNICORN_WORKERS processes, each running GUNICORN_THREADS threads (gthread workers)
+- GUNICORN_KEEPALIVE seconds an idle keep-alive connection is kept open, longer than the reverse proxy keeps its own
+- GUNICORN_TIMEOUT seconds a request may take before its worker is restarted, and GUNICORN_GRACEFUL_TIMEOUT seconds
+  the workers get to finish their requests on shutdown or reload (kill -HUP the master to reload the workers)
+- GUNICORN_MAX_REQUESTS requests after which a worker is replaced (0 never), to bound memory growth
+- GUNICORN_RELOAD (true or 1) to restart the workers when the code changes, for development
+The application is loaded once in the master before the workers are forked (preload_app), except with reload.
+"""
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+reload = os.environ.get("GUNICORN_RELOAD", "").lower() in ("1", "true")
+preload_app = not reload
+
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 75))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "WARNING").lower()
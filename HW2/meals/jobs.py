@@ -0,0 +1,91 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .database import IdAllocator, getDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class JobCollection:
+    """ JobCollection runs dish creations in the background and stores their outcome
+        Each job is stored in the "jobs" collection of MongoDB, with a unique numerical ID (also its _id)
+        allocated from the counters, so that every replica of the service finds the jobs of the others.
+        A job has the following fields: ID, dish name, status (pending, done or failed),
+        dish ID once done, error code once failed
+        A job runs in the process which received it, and stays pending if that process stops before it ends.
+    """
+
+    def __init__(self, workers=4, max_jobs=10000):
+        """ Initialize the worker pool
+        :param workers: number of dish creations running at the same time
+        :param max_jobs: number of jobs kept before the oldest finished ones are forgotten
+        """
+
+        self.max_jobs = max_jobs
+        self.ids = IdAllocator("jobs")
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+
+    @property
+    def jobs(self):
+        """ The "jobs" collection, created by MongoDB on first use """
+
+        return getDatabase()["jobs"]
+
+    def submit(self, dish_name, insert):
+        """ Queue the creation of a dish
+        :param dish_name: name of the dish to create
+        :param insert: function creating the dish, returning its ID or an error code
+        :return: ID of the new job
+        """
+
+        [id] = self.ids.allocate()
+        self.jobs.insert_one({"_id": id, "ID": id, "name": dish_name, "status": "pending", "dish": None, "error": None})
+        self.prune(id)
+
+        self.executor.submit(self.run, id, dish_name, insert)
+        logger.debug("JobCollection: queued job %s for dish %s", id, dish_name)
+        return id
+
+    def run(self, id, dish_name, insert):
+        """ Create the dish of a job and record the outcome """
+
+        try:
+            code = insert(dish_name)
+        except Exception as e:
+            logger.warning("JobCollection: job %s raised %s", id, e)
+            code = -4
+
+        if code > 0:
+            outcome = {"status": "done", "dish": code}
+        else:  # -2 already exists, -3 not recognized, -4 not reachable
+            outcome = {"status": "failed", "error": code}
+        try:
+            self.jobs.update_one({"_id": id}, {"$set": outcome})
+        except Exception as e:
+            logger.warning("JobCollection: could not record the outcome of job %s: %s", id, e)
+
+    def prune(self, last_id):
+        """ Forget the finished jobs older than the last max_jobs jobs
+        :param last_id: ID of the newest job
+        """
+
+        if last_id > self.max_jobs:
+            self.jobs.delete_many({"_id": {"$lte": last_id - self.max_jobs}, "status": {"$ne": "pending"}})
+
+    def findJobID(self, id):
+        """ Return a copy of the job specified by its ID
+        :param id: the ID of the job
+        :return: True and the job if found, False and None if not
+        """
+
+        job = self.jobs.find_one({"_id": id}, {"_id": 0})
+        if job is None:
+            return False, None
+        return True, job
+
+
+# create JobCollection instance with global scope, configured from the environment
+jobColl = JobCollection(
+    workers=int(os.environ.get("JOB_WORKERS", 4)),
+    max_jobs=int(os.environ.get("JOB_MAX_JOBS", 10000))
+)
@@ -1,7 +1,19 @@
-from .model import Dishes, DishesID, DishesName, Meals, MealsID, MealsName
+import logging
+import os
+from .model import Dishes, DishesBatch, DishesID, DishesName, JobsID, Meals, MealsID, MealsName, dishColl, mealColl
+from .cache import enableHttpCache
+from .database import ping
+from .diets import diet_client
+from .metrics import UPSTREAM_LATENCY, instrument, registry
+from .nutrition import nutrition_cache, nutrition_client
 from flask import Flask
 from flask_restful import Api
 
+# Log at LOG_LEVEL (WARNING by default, so the per-request debug logging stays off in the hot path)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -11,12 +23,18 @@ api = Api(app)
 # Associate the Resource /dishes with the Dishes class
 api.add_resource(Dishes, '/dishes')
 
+# Associate the Resource /dishes:batch with the DishesBatch class
+api.add_resource(DishesBatch, '/dishes:batch')
+
 # Associate the Resource /dishes/ID with the DishesID class
 api.add_resource(DishesID, '/dishes/<int:id>')
 
 # Associate the Resource /dishes/ID with the DishesName class
 api.add_resource(DishesName, '/dishes/<string:name>')
 
+# Associate the Resource /jobs/ID with the JobsID class
+api.add_resource(JobsID, '/jobs/<int:id>')
+
 # Associate the Resource /old with the Meals class
 api.add_resource(Meals, '/meals')
 
@@ -26,9 +44,42 @@ api.add_resource(MealsID, '/meals/<int:id>')
 # Associate the Resource /meal/name with the MealsName class
 api.add_resource(MealsName, '/meals/<string:name>')
 
+# Let the reverse proxy cache the GET responses under the version of their collection
+enableHttpCache(app, {'/dishes': dishColl.etag, '/meals': mealColl.etag})
+
+# Liveness: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return {"status": "ok"}, 200
+
+
+# Readiness: MongoDB answers, so the service can serve requests
+@app.route('/readyz')
+def readyz():
+    error = ping()
+    if error is not None:
+        logger.warning("Not ready, MongoDB does not answer: %s", error)
+        return {"status": "unavailable"}, 503
+    return {"status": "ok"}, 200
+
+
+# Expose /metrics: request counts and latencies per Resource class and method, upstream call latencies,
+# collection sizes, nutrition cache and diet cache counters
+instrument(app)
+nutrition_client.listeners.append(
+    lambda latency: UPSTREAM_LATENCY.observe(latency, upstream="api-ninjas", operation="nutrition"))
+registry.callback("collection_size", "Number of documents in each collection", ["collection"],
+                  lambda: {("dishes",): dishColl.dishes.estimated_document_count(), ("meals",): mealColl.meals.estimated_document_count()})
+registry.callback("nutrition_cache_events_total", "Nutrition cache hits, misses and evictions", ["event"],
+                  lambda: {(event,): count for event, count in nutrition_cache.stats().items() if event in ("hits", "misses", "evictions")},
+                  type="counter")
+registry.callback("diet_cache_events_total", "Diet cache hits, misses and revalidations", ["event"],
+                  lambda: {(event,): count for event, count in diet_client.stats().items() if event != "size"},
+                  type="counter")
+
 if __name__ == '__main__':
 
-    print("running main.py")
+    logger.info("running main.py")
 
     # run Flask app
     # app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+"""
+Prometheus-style metrics, exposed in the text exposition format on /metrics:
+- Counter and Histogram are updated by the service as requests and upstream calls happen
+- CallbackMetric reads its values when scraped (collection sizes, cache counters)
+- instrument(app) records the count and latency of every request per Resource class and method
+"""
+
+
+def formatLabels(labelnames, labelvalues, extra=None):
+    """ Format a set of labels as {name="value",...} """
+
+    pairs = list(zip(labelnames, labelvalues)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """ Counter stores monotonically increasing values
+        Each value is stored in a dictionary with the tuple of label values as key
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """ Increment the value of a set of labels """
+
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, formatLabels(self.labelnames, key), value) for key, value in self.values.items()]
+
+
+class Histogram:
+    """ Histogram stores the distribution of observed values in cumulative buckets
+        Each distribution is stored in a dictionary with the tuple of label values as key,
+        and a value of the following: count per bucket, sum, count
+    """
+
+    type = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """ Record a value for a set of labels """
+
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Record the duration of a block in seconds """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", formatLabels(self.labelnames, key, [("le", bound)]), cumulative))
+                samples.append((f"{self.name}_bucket", formatLabels(self.labelnames, key, [("le", "+Inf")]), count))
+                samples.append((f"{self.name}_sum", formatLabels(self.labelnames, key), total))
+                samples.append((f"{self.name}_count", formatLabels(self.labelnames, key), count))
+        return samples
+
+
+class CallbackMetric:
+    """ CallbackMetric reads its values from a function each time it is scraped
+        The function returns a dictionary with the tuple of label values as key
+    """
+
+    def __init__(self, name, help, labelnames, fn, type="gauge"):
+
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.fn = fn
+        self.type = type
+
+    def samples(self):
+        return [(self.name, formatLabels(self.labelnames, key), value) for key, value in self.fn().items()]
+
+
+class Registry:
+    """ Registry holds the metrics of the service and renders them for /metrics """
+
+    def __init__(self):
+
+        self.metrics = []
+
+    def register(self, metric):
+
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, labelnames, fn, type="gauge"):
+        return self.register(CallbackMetric(name, help, labelnames, fn, type))
+
+    def render(self):
+        """ Render all metrics in the Prometheus text exposition format """
+
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:  # a failing callback should not break the whole scrape
+                logger.warning("metrics: could not collect %s: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# create the Registry instance and the request/upstream metrics with global scope
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "http_requests_total", "Number of HTTP requests", ["resource", "method", "code"])
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests", ["resource", "method"])
+UPSTREAM_LATENCY = registry.histogram(
+    "upstream_request_duration_seconds", "Latency of calls to upstream services", ["upstream", "operation"])
+
+
+def instrument(app):
+    """ Record the count and latency of every request of app and expose /metrics """
+
+    @app.before_request
+    def startTimer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def recordRequest(response):
+        if request.endpoint == "metrics" or "metrics_start" not in g:
+            return response
+
+        # label requests with the Resource class serving them (e.g. DishesID)
+        view = current_app.view_functions.get(request.endpoint)
+        resource = getattr(getattr(view, "view_class", None), "__name__", request.endpoint or "unmatched")
+
+        REQUESTS.inc(resource=resource, method=request.method, code=response.status_code)
+        REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_start, resource=resource, method=request.method)
+        return response
+
+    @app.route("/metrics", endpoint="metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -1,7 +1,11 @@
-import requests
+import logging
 from flask import request
 from flask_restful import Resource
 from .collection import DishCollection, MealCollection
+from .diets import diet_client
+from .jobs import jobColl
+
+logger = logging.getLogger(__name__)
 
 """
 The resources are:
@@ -10,12 +14,55 @@ The resources are:
 - /meals/{ID} or /meals/{name}      Each meal resource is expressed with a specific JSON object
 - /dishes                           This is a collection class, containing all the dishes 
 - /dishes/{ID} or /dishes/{name}    Each dish resource is expressed with a specific JSON object
+- /jobs/{ID}                        Each job resource reports the outcome of an asynchronous dish creation
 - /diets or /diets/{name}            Each diet resource is expressed with a specific JSON object
 """
 
 # create DishCollection instance with global scope
 dishColl = DishCollection()
 
+# fields of the dishes and meals that can be selected with ?fields=
+DISH_FIELDS = ["name", "ID", "cal", "size", "sodium", "sugar"]
+MEAL_FIELDS = ["name", "ID", "appetizer", "main", "dessert", "cal", "sodium", "sugar"]
+
+
+def parsePage(allowed_fields):
+    """ Parse the pagination and projection query parameters of a GET on a collection:
+    ?limit= (page size), ?after= (the X-Next-Cursor header of the previous page) and ?fields= (comma separated)
+    :param allowed_fields: fields of the objects of the collection
+    :return: after, limit and fields, or None if one of them is not valid
+    """
+
+    try:
+        after = int(request.args.get('after', 0))
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return None
+
+    if after < 0 or (limit is not None and limit < 1):
+        return None
+
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = fields.split(',')
+        if not all(field in allowed_fields for field in fields):
+            return None
+
+    return after, limit, fields
+
+
+def notModified(etag):
+    """ Check whether the client already has the content identified by etag (If-None-Match header) """
+
+    return request.if_none_match.contains_raw(etag)
+
+
+def pageHeaders(next_after):
+    """ Return the headers of a page, with the cursor of the next page if there is one """
+
+    return {'X-Next-Cursor': str(next_after)} if next_after is not None else {}
+
 
 class Dishes(Resource):
     """ The Dishes class implements the REST operations for the /dishes resource
@@ -28,12 +75,23 @@ class Dishes(Resource):
 
     def get(self):
         """
-        Retrieves a specific dish from the collection
-        :param key: the key used to search for a dish (either ID or name)
-        :return: JSON object listing all dishes (indexed by ID) and the status code
+        Retrieves the dishes from the collection, a page at a time if ?limit=, ?after= or ?fields= is given
+        :return: JSON object listing the dishes (indexed by ID) and the status code
         """
 
-        return dishColl.retrieveAllDishes(), 200
+        page = parsePage(DISH_FIELDS)
+        if page is None:  # one of the query parameters is not valid
+            return -1, 422
+
+        etag = dishColl.etag()
+        if notModified(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
+        if page == (0, None, None):
+            return dishColl.retrieveAllDishes(), 200, {'ETag': etag}
+
+        dishes, next_after = dishColl.retrieveDishes(*page)
+        return dishes, 200, dict(pageHeaders(next_after), ETag=etag)
 
     def post(self):
         """
@@ -43,21 +101,21 @@ class Dishes(Resource):
         """
 
         if request.headers is None:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
 
         # if request content-type is not application/json
         if 'Content-Type' not in dict(request.headers).keys():
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
         else:
             if dict(request.headers)['Content-Type'] != "application/json":
-                print("Request Content-Type is not application/json")
+                logger.debug("Request Content-Type is not application/json")
                 return 0, 415
         try:
             data = request.json
         except Exception as e:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
 
         # if body is not of type dict
@@ -70,6 +128,11 @@ class Dishes(Resource):
             else:
                 d = data['name']
 
+        # if the client prefers an asynchronous response, create the dish in the background
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            job_id = jobColl.submit(d, dishColl.insertDish)
+            return job_id, 202, {'Location': f'/jobs/{job_id}', 'Preference-Applied': 'respond-async'}
+
         id = dishColl.insertDish(d)  # add d to collection
 
         if id == -2:   # dish already exists
@@ -88,6 +151,42 @@ class Dishes(Resource):
         return "This method is not allowed for the requested URL", 405
 
 
+class DishesBatch(Resource):
+    """ The DishesBatch class implements the REST operations for the /dishes:batch resource
+    /dishes:batch
+        POST (add the dishes of the given list of names)
+    """
+
+    global dishColl
+
+    def post(self):
+        """
+        Adds several dishes to /dishes, looking up their nutrition concurrently
+        :param key: JSON list of names used to add the dishes
+        :return: JSON object mapping each name to its new dish ID or error code
+        """
+
+        # if request content-type is not application/json
+        if 'Content-Type' not in dict(request.headers).keys():
+            logger.debug("Request Content-Type not specified in header")
+            return 0, 415
+        else:
+            if dict(request.headers)['Content-Type'] != "application/json":
+                logger.debug("Request Content-Type is not application/json")
+                return 0, 415
+        try:
+            data = request.json
+        except Exception as e:
+            logger.debug("Request Content-Type not specified in header")
+            return 0, 415
+
+        # if body is not a list of names
+        if type(data) != list or not all(type(name) == str for name in data):
+            return -1, 422
+
+        return dishColl.insertDishes(data), 200
+
+
 class DishesID(Resource):
     """ Implements the REST operations for the /dishes/{ID} resource
 
@@ -106,9 +205,13 @@ class DishesID(Resource):
         :return: the dish JSON object and the status code
         """
 
+        etag = dishColl.etag()
+        if notModified(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
         (status, dish_obj) = dishColl.findDishID(id)
         if status: # return the word and HTTP 200 ok code
-            return dish_obj, 200
+            return dish_obj, 200, {'ETag': etag}
         else: # if dish not found
             return -5, 404
 
@@ -165,13 +268,40 @@ class DishesName(Resource):
         :return: the dish and the status code
         """
 
+        etag = dishColl.etag()
+        if notModified(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
         (status, dish_obj) = dishColl.findDishName(name)
         if status: # return the word and HTTP 200 ok code
-            return dish_obj, 200
+            return dish_obj, 200, {'ETag': etag}
         else: # return 0 for key and Not Found error code
             return -5, 404
 
 
+class JobsID(Resource):
+    """ Implements the REST operations for the /jobs/{ID} resource
+
+    /jobs/{ID}
+        GET (return the JSON object of the job given the ID)
+    """
+
+    global jobColl
+
+    def get(self, id):
+        """ Retrieve the status of an asynchronous dish creation based on its ID
+
+        :param id: the ID of the job to retrieve
+        :return: the job JSON object (pending, done with the dish ID, or failed with the error code) and the status code
+        """
+
+        (status, job_obj) = jobColl.findJobID(id)
+        if status: # return the job and HTTP 200 ok code
+            return job_obj, 200
+        else:      # if job not found
+            return -5, 404
+
+
 # create MealCollection instance with global scope
 mealColl = MealCollection()
 
@@ -192,37 +322,23 @@ class Meals(Resource):
         Otherwise - return all meals
         """
 
+        # Return the meals a page at a time if ?limit=, ?after= or ?fields= is given
+        page = parsePage(MEAL_FIELDS)
+        if page is None:  # one of the query parameters is not valid
+            return -1, 422
+
         diet_name = request.args.get('diet')
         if diet_name:
 
-            print(f"Searching for diet name {diet_name}")
-
-            # Define diets url with diet name
-            diets_service_url = f"http://diets-service:5002/diets/{diet_name}"
-
-            # Send GET request to diets service
-            diet_response = requests.get(diets_service_url)
-
-            # If the diet exists, extract and filter for meals
-            if diet_response.status_code == 200:
-
-                # Extract diet
-                diet = diet_response.json()
+            logger.debug("Searching for diet name %s", diet_name)
 
-                filtered_meals = []
-                for meal in mealColl.retrieveAllMeals():
+            # Get the diet from the diets cache, or from diets service
+            found, diet = diet_client.findDiet(diet_name)
 
-                    # if the meal has valid components
-                    if meal["cal"] is not None and meal["sodium"] is not None and meal["sugar"] is not None:
-
-                        # if the meal satisfies the diet
-                        if (
-                            meal['cal'] <= diet['cal'] and
-                            meal['sodium'] <= diet['sodium'] and
-                            meal['sugar'] <= diet['sugar']
-                        ):
-                            filtered_meals.append(meal)
-                return filtered_meals, 200
+            # If the diet exists, let the database filter the meals satisfying it
+            if found:
+                meals, next_after = mealColl.retrieveDietMeals(diet, *page)
+                return meals, 200, pageHeaders(next_after)
 
             # No diet of that name exists
             else:
@@ -230,7 +346,15 @@ class Meals(Resource):
 
         # Return all meals if no diet was specified
         else:
-            return mealColl.retrieveAllMeals(), 200
+            etag = mealColl.etag()
+            if notModified(etag):  # the client has the current version, skip the collection
+                return None, 304, {'ETag': etag}
+
+            if page == (0, None, None):
+                return mealColl.retrieveAllMeals(), 200, {'ETag': etag}
+
+            meals, next_after = mealColl.retrieveMeals(*page)
+            return meals, 200, dict(pageHeaders(next_after), ETag=etag)
 
     def post(self):
         """
@@ -239,22 +363,22 @@ class Meals(Resource):
         """
 
         if request.headers is None:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
 
         # if request content-type is not application/json
         if 'Content-Type' not in dict(request.headers).keys():
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
         else:
             if dict(request.headers)['Content-Type'] != "application/json":
-                print("Request Content-Type is not application/json")
+                logger.debug("Request Content-Type is not application/json")
                 return 0, 415
 
         try:
             data = request.json
         except Exception as e:
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
 
         # if body is not of type dict
@@ -280,6 +404,8 @@ class Meals(Resource):
             key = mealColl.insertMeal(meal_name, appetizer_id, main_id, dessert_id, dishColl)
             if key == -2:  # meal already exists
                 return -2, 422
+            if key == -6:  # one of the dishes was deleted meanwhile
+                return -6, 422
             return key, 201
 
         else:  # one of the dish IDs does not exist
@@ -317,9 +443,13 @@ class MealsID(Resource):
         :return: the meal and the status code
         """
 
+        etag = mealColl.etag()
+        if notModified(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
         (b, m) = mealColl.findMealID(id)
         if b:  # return the meal and HTTP 200 ok code
-            return m, 200
+            return m, 200, {'ETag': etag}
         else:  # return -5 for key and Not Found error code
             return -5, 404
 
@@ -331,11 +461,11 @@ class MealsID(Resource):
 
         # if request content-type is not application/json
         if 'Content-Type' not in dict(request.headers).keys():
-            print("Request Content-Type not specified in header")
+            logger.debug("Request Content-Type not specified in header")
             return 0, 415
         else:
             if dict(request.headers)['Content-Type'] != "application/json":
-                print("Request Content-Type is not application/json")
+                logger.debug("Request Content-Type is not application/json")
                 return 0, 415
 
         data = request.json
@@ -350,7 +480,7 @@ class MealsID(Resource):
             all_present = all(elem in keys for elem in data.keys())
 
             if not all_present:
-                print(f"One of the required parameters was not specified")
+                logger.debug("One of the required parameters was not specified")
                 return -1, 422
             else:
                 meal_name = data['name']
@@ -366,6 +496,12 @@ class MealsID(Resource):
             if b: # return boolean and HTTP 200 ok code
                 return w, 200
 
+            elif w == -2: # another meal already has the new name
+                return -2, 422
+
+            elif w == -6: # one of the dishes was deleted meanwhile
+                return -6, 422
+
             else: # meal with ID=id wasn't found, return -5 and Not Found error code
                 return -5, 404
 
@@ -402,8 +538,12 @@ class MealsName(Resource):
         :return: the meal and the status code
         """
 
+        etag = mealColl.etag()
+        if notModified(etag):  # the client has the current version, skip the collection
+            return None, 304, {'ETag': etag}
+
         (b, w) = mealColl.findMealName(name)
         if b:
-            return w, 200  # return the word and HTTP 200 ok code
+            return w, 200, {'ETag': etag}  # return the word and HTTP 200 ok code
         else:
             return -5, 404  # return 0 for key and Not Found error code
\ No newline at end of file
@@ -0,0 +1,566 @@
+import abc
+import csv
+import difflib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+"""
+Nutrition lookups for new dishes, backed by API Ninja/Nutrition or a bundled food table:
+- NutritionCache is a bounded LRU+TTL cache of summed nutrition results, keyed by the provider and the normalized query
+- NutritionClient is a pooled, keep-alive HTTP client for the API with timeouts and bounded retries
+- NutritionProvider is the interface of the nutrition sources: ApiNinjasProvider, LocalNutritionProvider
+  and FallbackProvider, selected with NUTRITION_PROVIDER ("remote", "local" or an ordered list like "remote,local")
+- lookupNutrition returns the summed nutrition of a dish name, consulting the cache before the provider
+- lookupNutritionBatch resolves several dish names concurrently with a bounded thread pool
+- SingleFlight lets concurrent callers with the same key share one call instead of repeating it
+"""
+
+API_URL = 'https://api.api-ninjas.com/v1/nutrition?query={}'
+API_KEY = os.environ.get("NINJAS_API_KEY", '6zoIr+IoEg7H2GQGVDxw+g==WdtcKEIt1DOIoGKj')
+
+
+class NutritionCache:
+    """ NutritionCache stores the summed nutrition of previously looked up queries
+        Each entry is stored in an ordered dictionary (least recently used first) with the
+        provider name and the normalized query as key, and a value of the following: expiry time, nutrition totals
+        The persistence file is a list of JSON lines, one appended per new entry, and it is rewritten
+        with the current entries once it has twice as many lines as the cache has room for.
+    """
+
+    def __init__(self, maxsize=1024, ttl=86400, path=None):
+        """ Initialize an empty cache, loading the persistence file if one is given
+        :param maxsize: maximum number of entries before the least recently used is evicted
+        :param ttl: number of seconds an entry stays valid
+        :param path: optional JSON file the cache is persisted to so it survives restarts
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # number of lines in the persistence file
+        self.lines = 0
+
+        if self.path is not None:
+            self.load()
+
+    @staticmethod
+    def normalize(query):
+        """ Normalize a query so that trivially different spellings share an entry """
+
+        return " ".join(query.lower().split())
+
+    def key(self, query, provider):
+        """ Return the key of a query answered by a provider """
+
+        return f"{provider}:{self.normalize(query)}"
+
+    def get(self, query, provider):
+        """ Return the cached nutrition totals of a query
+        :param query: dish name
+        :param provider: name of the provider of the totals
+        :return: dictionary of nutrition totals, or None if not cached or expired
+        """
+
+        key = self.key(query, provider)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, totals = entry
+            if expires <= time.time():  # stale entry, drop it and count as a miss
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)  # mark as most recently used
+            self.hits += 1
+            return totals
+
+    def put(self, query, provider, totals):
+        """ Store the nutrition totals of a query, evicting the least recently used entries if full
+        :param query: dish name
+        :param provider: name of the provider of the totals
+        :param totals: dictionary of nutrition totals
+        """
+
+        key = self.key(query, provider)
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, totals)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+            if self.path is not None:
+                if self.lines >= 2 * self.maxsize:
+                    self.save()
+                else:
+                    self.append(key, self.entries[key])
+
+    def stats(self):
+        """ Return the cache counters """
+
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def load(self):
+        """ Load the unexpired entries of the persistence file, if it exists """
+
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:  # nothing persisted yet
+            return
+        except OSError as e:
+            logger.warning("NutritionCache: not loading %s: %s", self.path, e)
+            return
+
+        now = time.time()
+        for line in lines:  # saved least recently used first, a later line replaces an earlier one
+            try:
+                key, (expires, totals) = json.loads(line)
+            except (ValueError, TypeError):  # e.g. a line cut short by a crash
+                continue
+            self.entries.pop(key, None)
+            if expires > now:
+                self.entries[key] = (expires, totals)
+        self.lines = len(lines)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def append(self, key, entry):
+        """ Append an entry to the persistence file """
+
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps([key, list(entry)]) + "\n")
+            self.lines += 1
+        except OSError as e:
+            logger.warning("NutritionCache: could not save %s: %s", self.path, e)
+
+    def save(self):
+        """ Write the current entries to the persistence file, replacing it atomically """
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.writelines(json.dumps([key, list(entry)]) + "\n" for key, entry in self.entries.items())
+            os.replace(tmp_path, self.path)
+            self.lines = len(self.entries)
+        except OSError as e:
+            logger.warning("NutritionCache: could not save %s: %s", self.path, e)
+
+
+# create NutritionCache instance with global scope, configured from the environment
+nutrition_cache = NutritionCache(
+    maxsize=int(os.environ.get("NUTRITION_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("NUTRITION_CACHE_TTL", 86400)),
+    path=os.environ.get("NUTRITION_CACHE_FILE")
+)
+
+
+class NutritionClient:
+    """ NutritionClient sends queries to API Ninja/Nutrition over a shared keep-alive connection pool
+        Each call is bounded by connect/read timeouts and retried with jittered exponential backoff
+        on connection errors, timeouts, 429 and 5xx responses. The latency of every call is recorded.
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2):
+        """ Initialize the session and mount a connection pool for the API
+        :param pool_size: maximum number of keep-alive connections to the API
+        :param connect_timeout: seconds to wait for the TCP+TLS connection
+        :param read_timeout: seconds to wait for the response
+        :param retries: number of retries after the first attempt
+        :param backoff: base delay in seconds, doubled on each retry
+        """
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({'X-Api-Key': API_KEY})
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        # latencies of the most recent calls in seconds, with running totals over all calls
+        self.latencies = deque(maxlen=1000)
+        self.calls, self.total_latency = 0, 0.0
+        self.lock = threading.Lock()
+
+        # functions called with the latency of each call, e.g. to export it as a metric
+        self.listeners = []
+
+    def query(self, query):
+        """ Query API Ninja/Nutrition, retrying transient failures
+        :param query: dish name
+        :return: the last response received
+        :raises: requests.RequestException if no response was received after all retries
+        """
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:  # full jitter: sleep a random delay up to the exponential backoff
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(API_URL.format(query), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(time.perf_counter() - start)
+                logger.warning("NutritionClient: attempt %s failed: %s", attempt + 1, e)
+                if attempt == self.retries:
+                    raise
+                continue
+            self.record(time.perf_counter() - start)
+
+            if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.retries:
+                return response
+            logger.warning("NutritionClient: attempt %s returned %s", attempt + 1, response.status_code)
+
+    def record(self, latency):
+        """ Record the latency of a call """
+
+        with self.lock:
+            self.latencies.append(latency)
+            self.calls += 1
+            self.total_latency += latency
+
+        for listener in self.listeners:
+            listener(latency)
+
+    def stats(self):
+        """ Return the call count, mean latency and the latency percentiles of the recent calls """
+
+        with self.lock:
+            recent = sorted(self.latencies)
+            calls, total_latency = self.calls, self.total_latency
+
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(p * len(recent)))] if recent else None
+
+        return {
+            "calls": calls,
+            "mean": total_latency / calls if calls else None,
+            "p50": percentile(0.50),
+            "p99": percentile(0.99)
+        }
+
+
+# create NutritionClient instance with global scope, configured from the environment
+nutrition_client = NutritionClient(
+    pool_size=int(os.environ.get("NUTRITION_POOL_SIZE", 10)),
+    connect_timeout=float(os.environ.get("NUTRITION_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("NUTRITION_READ_TIMEOUT", 10)),
+    retries=int(os.environ.get("NUTRITION_RETRIES", 2)),
+    backoff=float(os.environ.get("NUTRITION_BACKOFF", 0.2))
+)
+
+
+class SingleFlight:
+    """ SingleFlight keeps a table of the calls in flight
+        Each call is stored in a dictionary with its key, and a value of the future result that
+        concurrent callers with the same key wait on
+    """
+
+    def __init__(self):
+
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """ Run fn unless a call with the same key is already in flight, in which case wait for its result
+        :param key: key identifying the call
+        :param fn: function to run without arguments
+        :return: the result of fn and True if this caller ran it, False if it shared another caller's result
+        """
+
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            return future.result(), False
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+        future.set_result(result)
+        return result, True
+
+
+class NutritionProvider(abc.ABC):
+    """ NutritionProvider is the interface of the sources of nutrition data behind insertDish
+        A provider sums the nutrition of the foods in a query and returns a status code
+        (0 if found, -3 if not recognized, -4 if not reachable) and the totals:
+            cal, size, sodium, sugar
+        name identifies the provider in the cache, and cached tells whether its answers are worth caching
+    """
+
+    name = None
+    cached = False
+
+    @abc.abstractmethod
+    def lookup(self, query):
+        """ Look up the nutrition of a query
+        :param query: the dish name
+        :return: status code and the totals, None if not found
+        """
+
+
+class ApiNinjasProvider(NutritionProvider):
+    """ ApiNinjasProvider looks up the nutrition of a query through API Ninja/Nutrition """
+
+    name = "remote"
+    cached = True  # a round trip to the API
+
+    def __init__(self, client):
+
+        self.client = client
+
+    def lookup(self, query):
+
+        try:
+            # Query API Ninja /nutrition
+            response = self.client.query(query)
+
+            if response.status_code != requests.codes.ok:  # Check status code of response
+                logger.warning("Api Ninja/Nutrition not reachable: %s, %s", response.status_code, response.text)
+                return -4, None
+
+            dish_data = response.json()
+        except Exception as e:
+            logger.warning("Api Ninja/Nutrition not reachable: %s", e)
+            return -4, None
+
+        # If dish not recognized by api/ninja
+        if not dish_data:
+            logger.debug("Api Ninja/Nutrition does not recognize dish name: %s", query)
+            return -3, None
+
+        # Iterate over all dishes to accumulate components
+        totals = {"cal": 0, "size": 0, "sodium": 0, "sugar": 0}
+        for _dish in dish_data:
+            totals["cal"] += _dish["calories"]
+            totals["sodium"] += _dish["sodium_mg"]
+            totals["sugar"] += _dish["sugar_g"]
+            totals["size"] += _dish["serving_size_g"]
+
+        return 0, totals
+
+
+class LocalNutritionProvider(NutritionProvider):
+    """ LocalNutritionProvider looks up the nutrition of a query in a bundled food table
+        Each food is stored in a dictionary with its normalized name as key (lower case words,
+        singular, without quantities), and a value of the following: cal, size, sodium, sugar.
+        A second dictionary indexes the foods by word to match names that are not exact.
+        Its answers are not cached: the table is in memory, and a misspelled name may match another food.
+    """
+
+    name = "local"
+
+    def __init__(self, path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition.csv"), cutoff=0.8):
+        """ Load the food table
+        :param path: CSV file with the columns name, calories, sodium_mg, sugar_g, serving_size_g
+        :param cutoff: minimum similarity (0 to 1) for a misspelled name to match a food
+        """
+
+        self.cutoff = cutoff
+        self.foods = {}
+        self.words = {}  # {word:{name}} of the foods containing each word
+
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                name = self.normalize(row["name"])
+                self.foods[name] = {
+                    "cal": float(row["calories"]),
+                    "size": float(row["serving_size_g"]),
+                    "sodium": float(row["sodium_mg"]),
+                    "sugar": float(row["sugar_g"])
+                }
+                for word in name.split():
+                    self.words.setdefault(word, set()).add(name)
+
+        # foods grouped by first letter, the candidates of a misspelled name
+        self.by_letter = {}
+        for name in self.foods:
+            self.by_letter.setdefault(name[0], []).append(name)
+
+    @staticmethod
+    def singular(word):
+        """ Naively turn a plural word into its singular """
+
+        if len(word) > 3 and word.endswith("ies"):
+            return word[:-3] + "y"
+        if len(word) > 3 and word.endswith("oes"):
+            return word[:-2]
+        if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+            return word[:-1]
+        return word
+
+    @classmethod
+    def normalize(cls, name):
+        """ Normalize a name to lower case singular words, dropping quantities and punctuation """
+
+        return " ".join(cls.singular(word) for word in re.findall(r"[a-z]+", name.lower()))
+
+    def match(self, name):
+        """ Find the food matching a normalized name
+        :param name: normalized name
+        :return: name of the food in the table, or None if nothing matches
+        """
+
+        if name in self.foods:  # exact match
+            return name
+
+        # longest food whose words all appear in the name, e.g. "grilled chicken" -> "chicken"
+        words = set(name.split())
+        candidates = set().union(*(self.words.get(word, set()) for word in words))
+        contained = [food for food in candidates if set(food.split()) <= words]
+        if contained:
+            return max(contained, key=len)
+
+        # closest spelling among the foods with the same first letter, e.g. "spagetti" -> "spaghetti"
+        close = difflib.get_close_matches(name, self.by_letter.get(name[0], []), n=1, cutoff=self.cutoff)
+        return close[0] if close else None
+
+    def lookup(self, query):
+
+        name = self.normalize(query)
+        if not name:
+            return -3, None
+
+        # a food of the table such as "mac and cheese", otherwise each food of a list such as "bread and butter"
+        parts = [self.normalize(part) for part in re.split(r",|&|\band\b|\bwith\b", query.lower())]
+        parts = [part for part in parts if part]
+        if name in self.foods or len(parts) < 2:
+            parts = [name]
+        foods = [food for food in map(self.match, parts) if food]
+
+        if not foods:
+            logger.debug("LocalNutritionProvider: does not recognize dish name: %s", query)
+            return -3, None
+
+        totals = {"cal": 0, "size": 0, "sodium": 0, "sugar": 0}
+        for food in foods:
+            for component in totals:
+                totals[component] += self.foods[food][component]
+
+        return 0, totals
+
+
+class FallbackProvider(NutritionProvider):
+    """ FallbackProvider tries a list of providers in order until one finds the query
+        Each answer is cached (or not) as an answer of the provider which gave it
+    """
+
+    name = "fallback"
+
+    def __init__(self, providers):
+
+        self.providers = providers
+
+    def lookup(self, query):
+
+        results = []
+        for provider in self.providers:
+            code, totals = lookupNutrition(query, provider)
+            if code == 0:
+                return code, totals
+            results.append(code)
+
+        return results[0], None  # report the failure of the primary provider
+
+
+def createProvider(names):
+    """ Create the provider described by a comma separated list of provider names
+    :param names: "remote", "local", or a list such as "remote,local" to fall back in order
+    :return: NutritionProvider instance
+    """
+
+    providers = []
+    for name in names.split(","):
+        name = name.strip()
+        if name == "remote":
+            providers.append(ApiNinjasProvider(nutrition_client))
+        elif name == "local":
+            providers.append(LocalNutritionProvider())
+        else:
+            raise ValueError(f"Unknown nutrition provider: {name}")
+
+    return providers[0] if len(providers) == 1 else FallbackProvider(providers)
+
+
+# create the default NutritionProvider instance with global scope, configured from the environment
+nutrition_provider = createProvider(os.environ.get("NUTRITION_PROVIDER", "remote"))
+
+
+def lookupNutrition(dish_name, provider=None):
+    """ Return the summed nutrition of a dish name, using the cache before the provider
+    param: dish_name
+    param: provider: NutritionProvider to use, the default provider if None
+    return: status code (0 if found, -3 if not recognized, -4 if not reachable) and the totals
+    """
+
+    provider = provider or nutrition_provider
+    if not provider.cached:
+        return provider.lookup(dish_name)
+
+    totals = nutrition_cache.get(dish_name, provider.name)
+    if totals is not None:
+        return 0, totals
+
+    code, totals = provider.lookup(dish_name)
+    if code == 0:
+        nutrition_cache.put(dish_name, provider.name, totals)
+    return code, totals
+
+
+def lookupNutritionBatch(dish_names, provider=None, max_workers=int(os.environ.get("NUTRITION_BATCH_WORKERS", 8))):
+    """ Look up the summed nutrition of several dish names concurrently
+    param: dish_names: list of distinct dish names
+    param: provider: NutritionProvider to use, the default provider if None
+    return: dictionary of the form {dish_name:(status code, totals)}
+    """
+
+    if not dish_names:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(dish_names))) as executor:
+        return dict(zip(dish_names, executor.map(lambda dish_name: lookupNutrition(dish_name, provider), dish_names)))
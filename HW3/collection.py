@@ -1,4 +1,71 @@
-import requests
+import bisect
+import logging
+import threading
+import uuid
+from nutrition import NutritionCache, SingleFlight, lookupNutrition, lookupNutritionBatch
+from store import journaled, synced
+
+logger = logging.getLogger(__name__)
+
+def findPage(items, ids, after=0, limit=None, fields=None):
+    """ Find a page of items in ID order, starting after a cursor
+    :param items: dictionary of the form {key:item} where key is the ID of the item
+    :param ids: sorted list of the IDs of the items, the cursor is found in it by bisection
+    :param after: ID of the last item of the previous page, 0 for the first page
+    :param limit: maximum number of items in the page, no limit if None
+    :param fields: list of the fields to return (ID is always returned), all fields if None
+    :return: dictionary of the form {key:item} and the cursor of the next page, None if this is the last page
+    """
+
+    page = {}
+    while True:
+        # the IDs following the cursor, one more than the rest of the page to know whether a page follows.
+        # Writers may change the list meanwhile, so the position is found again for each slice
+        start = bisect.bisect_right(ids, after)
+        chunk = ids[start:] if limit is None else ids[start:start + limit + 1 - len(page)]
+        if not chunk:
+            return page, None
+
+        for id in chunk:
+            item = items.get(id)
+            if item is None:  # deleted since the IDs were read
+                continue
+
+            # another item follows a full page, the page ends at the last one added
+            if limit is not None and len(page) == limit:
+                return page, next(reversed(page))
+
+            if fields is None:
+                page[id] = item
+            else:
+                page[id] = {field: item[field] for field in ["ID"] + fields}
+
+        if limit is None:
+            return page, None
+        after = chunk[-1]
+
+
+class Snapshot(dict):
+    """ Snapshot is a read-only copy of the items of a collection at one version
+        It is built on the first read after a change, under the lock of the collection so that no writer
+        changes the dictionary during the copy, and shared by all readers until the next change
+    """
+
+    def __init__(self, items, version, last_id):
+        """ Copy the items of a collection
+        :param items: dictionary of the form {key:item}, copied while no change is made to it
+        :param version: version of the collection the items are from
+        :param last_id: highest ID given to an item so far
+        """
+
+        super().__init__(items)
+        self.version = version
+        self.last_id = last_id
+
+    def readOnly(self, *args, **kwargs):
+        raise TypeError("Snapshot is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = readOnly
 
 class DishCollection:
     """ DishCollection stores the dishes and performs operations on them
@@ -7,21 +74,86 @@ class DishCollection:
             dish name, calories, size (default 100g), sodium, suger
     """
 
-    def __init__(self):
+    def __init__(self, provider=None, journal=None):
+        """ Initialize an empty collection
+        :param provider: NutritionProvider used to look up new dishes, the default provider if None
+        :param journal: Journal sharing the collection with other processes, None to keep it in this process
+        """
 
         self.opNum = 0
         self.dishes = {}
+        self.provider = provider
+
+        # self.ids is the sorted list of the keys of self.dishes, through which pages are found
+        self.ids = []
+
+        # self.version is incremented by every change to the collection, and identifies its content in ETags
+        # together with self.instance, so that an ETag from before a restart never matches
+        self.version = 0
+        self.instance = uuid.uuid4().hex[:8]
+
+        # self.names is a secondary index of the form {name:id}, kept in sync with self.dishes
+        self.names = {}
+
+        # self.inflight coalesces concurrent insertions of the same normalized name into one lookup
+        self.inflight = SingleFlight()
+
+        # self.lock serializes the changes to the collection and its indexes (ID allocation included). Item reads
+        # take no lock, since the dish objects are never changed once added. Whole-collection reads go through a
+        # Snapshot, which the first reader after a change copies under the lock, holding the writers for the copy
+        self.lock = threading.Lock()
+        self.snapshot = Snapshot({}, self.version, self.opNum)
 
+        # with a journal, the changes of all processes are applied in the same order (see store.py), and the
+        # instance identifies the journal, so that all processes give the same ETags
+        self.journal = journal
+        if journal is not None:
+            self.instance = journal.register("dishes", self)
+
+    @synced
+    def etag(self):
+        """ Return the ETag of the current content of the collection """
+
+        return f'"dishes-{self.instance}-{self.version}"'
+
+    @synced
     def retrieveAllDishes(self):
         """
         Retrieve all dicts containing dishes insertDish
         :return: dictionary of all dishes in the collection
         """
-        print("DishCollection: retrieving all dishes:")
-        print(self.dishes)
+        logger.debug("DishCollection: retrieving all dishes")
+
+        return self.retrieveSnapshot()
+
+    def retrieveSnapshot(self):
+        """
+        Retrieve a read-only copy of the dishes, copied again (under the lock, so writers wait) only after a change
+        :return: Snapshot of the dishes
+        """
+
+        snapshot = self.snapshot
+        if snapshot.version != self.version:
+            with self.lock:
+                if self.snapshot.version != self.version:  # not copied by another reader meanwhile
+                    self.snapshot = Snapshot(self.dishes, self.version, self.opNum)
+                snapshot = self.snapshot
+        return snapshot
+
+    @synced
+    def retrieveDishes(self, after=0, limit=None, fields=None):
+        """
+        Retrieve a page of dishes in ID order
+        :param after: ID of the last dish of the previous page, 0 for the first page
+        :param limit: maximum number of dishes in the page, no limit if None
+        :param fields: list of the fields to return (ID is always returned), all fields if None
+        :return: dictionary of the dishes and the cursor of the next page, None if this is the last page
+        """
+        logger.debug("DishCollection: retrieving dishes after ID %s", after)
 
-        return self.dishes
+        return findPage(self.dishes, self.ids, after, limit, fields)
 
+    @synced
     def insertDish(self, dish_name):
         """
         Insert a new dish based on dish name
@@ -29,60 +161,86 @@ class DishCollection:
         return: id of the new dish (key) and status code
         """
 
-        # Iterate over existing dishes collection and check if dish with same name already exists
-        print("Checking if dish already exists")
-        for id, dish in self.dishes.items():
-            if dish["name"] == dish_name: # If dish already exists, returns an error
-                print("DishCollection: dish ", dish_name, " already exists")
-                return -2
+        # Check the name index if dish with same name already exists
+        logger.debug("Checking if dish already exists")
+        if dish_name in self.names: # If dish already exists, returns an error
+            logger.debug("DishCollection: dish %s already exists", dish_name)
+            return -2
 
-        try:
-            # Query API Ninja /nutrition
-            api_url = 'https://api.api-ninjas.com/v1/nutrition?query={}'.format(dish_name)
-            response = requests.get(api_url, headers={'X-Api-Key': '6zoIr+IoEg7H2GQGVDxw+g==WdtcKEIt1DOIoGKj'})
-
-            if response.status_code == requests.codes.ok: # Check status code of response
-                dish_data = response.json()
-
-                # If dish not recognized by api/ninja
-                if not dish_data:
-                    print("Api Ninja/Nutrition does not recognize dish name:", dish_data)
-                    return -3
-
-                else:
-                    # Dish is valid, proceed to adding dish to collection
-                    self.opNum += 1  # increment latest operation number
-
-                    # Iterate over all dishes to accumulate components
-                    total_calories, total_sodium, total_sugar, total_serving_size = 0, 0, 0, 0
-                    for _dish in dish_data:
-                        total_calories += _dish["calories"]
-                        total_sodium += _dish["sodium_mg"]
-                        total_sugar += _dish["sugar_g"]
-                        total_serving_size += _dish["serving_size_g"]
-
-                    # Add dish to dish collection
-                    self.dishes[self.opNum] = {
-                        "name": dish_name,
-                        "ID": self.opNum,
-                        "cal": total_calories,
-                        "size": total_serving_size,
-                        "sodium": total_sodium,
-                        "sugar": total_sugar
-                    }
-                    print(self.dishes)
-                    print("DishCollection: dish ", dish_name, " was added")
+        def lookupAndAdd():
+            # Look up the nutrition of the dish (cached, or through API Ninja/Nutrition)
+            code, totals = lookupNutrition(dish_name, self.provider)
+            if code != 0: # -3 if not recognized by api/ninja, -4 if not reachable
+                return code, totals, code
 
+            # Dish is valid, proceed to adding dish to collection
+            return code, totals, self.addDish(dish_name, totals)
 
+        # Concurrent insertions of the same normalized name share one lookup. The first one adds
+        # its dish before the others resume, so those with the same name deterministically get -2
+        (code, totals, id), leader = self.inflight.do(NutritionCache.normalize(dish_name), lookupAndAdd)
+        if leader or code != 0:
+            return id
+
+        return self.addDish(dish_name, totals)
+
+    @synced
+    def insertDishes(self, dish_names):
+        """
+        Insert several new dishes, looking up their nutrition concurrently
+        param: dish_names: list of dish names, repeated names are only inserted once
+        return: dictionary of the form {dish_name:id} where id is the new ID or an error code
+        """
+
+        results = {}
+        to_lookup = []
+        for dish_name in dict.fromkeys(dish_names): # de-duplicate, keeping the request order
+            if dish_name in self.names: # dish already exists
+                results[dish_name] = -2
             else:
-                print(f"Api Ninja/Nutrition not reachable: {response.status_code}, {response.text}")
-                return -4
-        except Exception as e:
-            print(f"Api Ninja/Nutrition not reachable: {e}")
-            return -4
+                to_lookup.append(dish_name)
+
+        # Resolve all new names concurrently, then add the valid ones in one pass
+        for dish_name, (code, totals) in lookupNutritionBatch(to_lookup, self.provider).items():
+            if code != 0: # -3 if not recognized by api/ninja, -4 if not reachable
+                results[dish_name] = code
+            else: # -2 if added by another request while looking up
+                results[dish_name] = self.addDish(dish_name, totals)
 
-        return self.opNum
+        return {dish_name: results[dish_name] for dish_name in dict.fromkeys(dish_names)}
 
+    @journaled
+    def addDish(self, dish_name, totals):
+        """
+        Add a dish whose nutrition was already looked up
+        param: dish_name and its nutrition totals
+        return: id of the new dish (key), or -2 if a dish with the same name exists
+        """
+
+        with self.lock:
+            if dish_name in self.names: # added by another request while looking up
+                logger.debug("DishCollection: dish %s already exists", dish_name)
+                return -2
+
+            self.opNum += 1  # increment latest operation number
+
+            # Add dish to dish collection
+            self.dishes[self.opNum] = {
+                "name": dish_name,
+                "ID": self.opNum,
+                "cal": totals["cal"],
+                "size": totals["size"],
+                "sodium": totals["sodium"],
+                "sugar": totals["sugar"]
+            }
+            self.names[dish_name] = self.opNum
+            self.ids.append(self.opNum)  # the highest ID, the list stays sorted
+            self.version += 1
+            logger.debug("DishCollection: dish %s was added", dish_name)
+
+            return self.opNum
+
+    @synced
     def findDishID(self, id):
         """
         Return a single JSON object of the dish specified by its ID
@@ -90,42 +248,49 @@ class DishCollection:
         :return: JSON object of the dish
         """
 
-        if id in self.dishes.keys():  # the id exists in collection
-            d = self.dishes[id]
-            print("DishCollection: found dish ", d, " with id ", id)
+        d = self.dishes.get(id)
+        if d is not None:  # the id exists in collection
+            logger.debug("DishCollection: found dish %s with id %s", d, id)
             return True, d
         else: # the id does not exist in the collection
-            print("DishCollection: did not find id", id)
+            logger.debug("DishCollection: did not find id %s", id)
             return False, None
 
+    @journaled
     def delDishID(self, id):
 
-        if id in self.dishes.keys():  # the key exists in collection
-            d = self.dishes[id]
-            del self.dishes[id]
-            print("DishCollection: deleted dish ", d, " with id ", id)
-            return True, id
+        with self.lock:
+            if id in self.dishes.keys():  # the key exists in collection
+                d = self.dishes[id]
+                del self.dishes[id]
+                del self.ids[bisect.bisect_left(self.ids, id)]
+                del self.names[d["name"]]
+                self.version += 1
+                logger.debug("DishCollection: deleted dish %s with id %s", d, id)
+                return True, id
 
-        else: # the key does not exist in the collection
-            return False, None
+            else: # the key does not exist in the collection
+                return False, None
 
+    @journaled
     def delDishName(self, name):
 
-        id_to_delete = None
-        for id, dish in self.dishes.items():
-            if dish["name"] == name:
-                id_to_delete = id
-                break
-
-        # Delete dish from dictionary by key
-        if id_to_delete is not None:
-            del self.dishes[id_to_delete]
-            print("DishCollection: deleted dish with name ", name)
-            return True, id_to_delete
-        else:
-            print("DishCollection: did not find dish_name ", name)
-            return False, None
+        with self.lock:
+            id_to_delete = self.names.get(name)
+
+            # Delete dish from dictionary by key
+            if id_to_delete is not None:
+                del self.dishes[id_to_delete]
+                del self.ids[bisect.bisect_left(self.ids, id_to_delete)]
+                del self.names[name]
+                self.version += 1
+                logger.debug("DishCollection: deleted dish with name %s", name)
+                return True, id_to_delete
+            else:
+                logger.debug("DishCollection: did not find dish_name %s", name)
+                return False, None
 
+    @synced
     def findDishName(self, name):
         """
         Return a single JSON object of the dish specified by its name
@@ -133,19 +298,17 @@ class DishCollection:
         return: value of the dish
         """
 
-        fetch_id = None
-        for id, dish in self.dishes.items():
-            if dish["name"] == name:
-                fetch_id = id
-                break
+        fetch_id = self.names.get(name)
+        d = self.dishes.get(fetch_id)  # None as well if deleted since the name was looked up
 
-        if fetch_id is not None: # Return dish from dictionary by key
-            print("DishCollection: found dish ", self.dishes[fetch_id], " with id ", fetch_id)
-            return True, self.dishes[fetch_id]
+        if d is not None: # Return dish from dictionary by key
+            logger.debug("DishCollection: found dish %s with id %s", d, fetch_id)
+            return True, d
         else:
-            print("DishCollection: did not find dish_name ", name)
+            logger.debug("DishCollection: did not find dish_name %s", name)
             return False, None  # the key does not exist in the collection
 
+    @synced
     def checkDishes(self, list_of_ids):
         """
         Checks if all IDs in a list exist in dishes
@@ -154,7 +317,7 @@ class DishCollection:
         """
 
         exists = all(elem in self.dishes.keys() for elem in list_of_ids)
-        print(f"All dishes exist: {exists}")
+        logger.debug("All dishes exist: %s", exists)
         return exists
 
 class MealCollection:
@@ -164,76 +327,168 @@ class MealCollection:
             name, ID, appetizer, main, dessert, cal, sodium, sugar
     """
 
-    def __init__(self):
+    def __init__(self, journal=None):
+        """ Initialize an empty collection
+        :param journal: Journal sharing the collection with other processes, None to keep it in this process
+        """
+
         # self.opNum is the number of insertMeal operations performed
         self.opNum = 0
 
         # self.meals is a dictionary of the form {key:meal} where key is an integer and meal is a list JSON objects
         self.meals = {}
 
+        # self.ids is the sorted list of the keys of self.meals, through which pages are found
+        self.ids = []
+
+        # self.names is a secondary index of the form {name:key}, kept in sync with self.meals
+        self.names = {}
+
+        # self.dish_refs is a reverse index of the form {dish_id:{(key, course)}} listing the meals
+        # (and the course slots within them) that reference each dish
+        self.dish_refs = {}
 
+        # self.version is incremented by every change to the collection, and identifies its content in ETags
+        # together with self.instance, so that an ETag from before a restart never matches
+        self.version = 0
+        self.instance = uuid.uuid4().hex[:8]
+
+        # self.lock serializes the changes to the collection and its indexes (ID allocation included). Item reads
+        # take no lock, since a meal object is replaced rather than changed. Whole-collection reads go through a
+        # Snapshot, which the first reader after a change copies under the lock, holding the writers for the copy
+        self.lock = threading.Lock()
+        self.snapshot = Snapshot({}, self.version, self.opNum)
+
+        # with a journal, the changes of all processes are applied in the same order (see store.py), and the
+        # instance identifies the journal, so that all processes give the same ETags
+        self.journal = journal
+        if journal is not None:
+            self.instance = journal.register("meals", self)
+
+    @synced
+    def etag(self):
+        """ Return the ETag of the current content of the collection """
+
+        return f'"meals-{self.instance}-{self.version}"'
+
+    @synced
     def retrieveAllMeals(self):
         """
         Retrieve all dicts containing meals
         :return: dictionary of all meals in the collection
         """
-        print("MealCollection: retrieving all meals:")
-        print(self.meals)
+        logger.debug("MealCollection: retrieving all meals")
+
+        return self.retrieveSnapshot()
+
+    def retrieveSnapshot(self):
+        """
+        Retrieve a read-only copy of the meals, copied again (under the lock, so writers wait) only after a change
+        :return: Snapshot of the meals
+        """
+
+        snapshot = self.snapshot
+        if snapshot.version != self.version:
+            with self.lock:
+                if self.snapshot.version != self.version:  # not copied by another reader meanwhile
+                    self.snapshot = Snapshot(self.meals, self.version, self.opNum)
+                snapshot = self.snapshot
+        return snapshot
+
+    @synced
+    def retrieveMeals(self, after=0, limit=None, fields=None):
+        """
+        Retrieve a page of meals in ID order
+        :param after: ID of the last meal of the previous page, 0 for the first page
+        :param limit: maximum number of meals in the page, no limit if None
+        :param fields: list of the fields to return (ID is always returned), all fields if None
+        :return: dictionary of the meals and the cursor of the next page, None if this is the last page
+        """
+        logger.debug("MealCollection: retrieving meals after ID %s", after)
+
+        return findPage(self.meals, self.ids, after, limit, fields)
+
+    def indexMeal(self, meal):
+        """ Add the course slots of a meal to the dish reference index
+        :param meal: meal object being added to the collection
+        """
+
+        for course in ["appetizer", "main", "dessert"]:
+            if meal[course] is not None:
+                self.dish_refs.setdefault(meal[course], set()).add((meal["ID"], course))
+
+    def unindexMeal(self, meal):
+        """ Remove the course slots of a meal from the dish reference index
+        :param meal: meal object being removed from the collection
+        """
 
-        return self.meals
+        for course in ["appetizer", "main", "dessert"]:
+            refs = self.dish_refs.get(meal[course])
+            if refs is not None:
+                refs.discard((meal["ID"], course))
+                if not refs:
+                    del self.dish_refs[meal[course]]
 
+    @journaled
     def updateMeals(self, dish_id):
-        """ Given a dish_id, update the meals
+        """ Given a dish_id, update the meals that reference it
         :param dish_id: dish ID being deleted
         """
 
-        for id, meal in self.meals.items(): # iterate over meals
-            delete_components = False
-
-            # null out the dish ID that was deleted and associated with the meal
-            if dish_id == meal["appetizer"]:
-                meal["appetizer"] = None
-                delete_components = True
-            if dish_id == meal["main"]:
-                meal["main"] = None
-                delete_components = True
-            if dish_id == meal["dessert"]:
-                dish_id["dessert"] = None
-                delete_components = True
+        with self.lock:
+            # only the meals listed in the reverse index contain the deleted dish
+            refs = self.dish_refs.pop(dish_id, set())
+            for id, course in refs:
+                meal = self.meals[id]
+                # null out the dish ID that was deleted and the components of the meal, in a new meal object
+                # since readers may hold the current one
+                self.meals[id] = dict(meal, **{course: None, "cal": None, "sodium": None, "sugar": None})
 
-            if delete_components: # if a dish ID was deleted, null out the components
-                meal["cal"], meal["sodium"], meal["sugar"] = None, None, None
+            if refs:
+                self.version += 1
 
+    @journaled
     def insertMeal(self, meal_name, appetizer_id, main_id, dessert_id, disheColl):
         """"
         Insert a meal given the name and the corresponding dish IDs. To create a meal, it
         computes the total number of calories, sodium, sugar.
 
         :param: meal name and component dish IDs
-        :returns: the ID of the created meal
+        :returns: the ID of the created meal, -2 if the name exists, -6 if one of the dishes was deleted meanwhile
         """
 
-        for id, meal in self.meals.items(): # check if meal exists, if so - return an error
-            if meal["name"] == meal_name:
-                print("MealCollection: meal ", meal_name, " already exists")
+        with self.lock:
+            if meal_name in self.names: # check if meal exists, if so - return an error
+                logger.debug("MealCollection: meal %s already exists", meal_name)
                 return -2
 
-        self.opNum += 1  # increment latest operation number
+            # a dish deleted after this point has its meals updated once the lock is released
+            dishes = [disheColl.dishes.get(dish_id) for dish_id in [appetizer_id, main_id, dessert_id]]
+            if None in dishes:
+                logger.debug("MealCollection: a dish of meal %s was deleted", meal_name)
+                return -6
+
+            self.opNum += 1  # increment latest operation number
 
-        self.meals[self.opNum] = { # sum over all components
-            "name": meal_name,
-            "ID": self.opNum,
-            "appetizer": appetizer_id,
-            "main": main_id,
-            "dessert": dessert_id,
-            "cal": sum(cal for cal in [disheColl.dishes[appetizer_id]["cal"], disheColl.dishes[main_id]["cal"], disheColl.dishes[dessert_id]["cal"]]),
-            "sodium": sum(sodium for sodium in [disheColl.dishes[appetizer_id]["sodium"], disheColl.dishes[main_id]["sodium"], disheColl.dishes[dessert_id]["sodium"]]),
-            "sugar": sum(sugar for sugar in [disheColl.dishes[appetizer_id]["sugar"], disheColl.dishes[main_id]["sugar"], disheColl.dishes[dessert_id]["sugar"]])
-        }
-        print("MealCollection: meal ", meal_name, " was added")
+            self.meals[self.opNum] = { # sum over all components
+                "name": meal_name,
+                "ID": self.opNum,
+                "appetizer": appetizer_id,
+                "main": main_id,
+                "dessert": dessert_id,
+                "cal": sum(dish["cal"] for dish in dishes),
+                "sodium": sum(dish["sodium"] for dish in dishes),
+                "sugar": sum(dish["sugar"] for dish in dishes)
+            }
+            self.names[meal_name] = self.opNum
+            self.ids.append(self.opNum)  # the highest ID, the list stays sorted
+            self.indexMeal(self.meals[self.opNum])
+            self.version += 1
+            logger.debug("MealCollection: meal %s was added", meal_name)
 
-        return self.opNum
+            return self.opNum
 
+    @journaled
     def delMealID(self, id):
         """" Given a meal ID, delete it from the collection
 
@@ -241,28 +496,35 @@ class MealCollection:
         :returns: True if successfully deleted, False if not found and the meals ID
         """
 
-        if id in self.meals.keys():  # the key exists in collection
-            d = self.meals[id]
-            del self.meals[id]
-            print("MealCollection: deleted meal ", d, " with id ", id)
-            return True, id
-        else:
-            return False, None  # the key does not exist in the collection
+        with self.lock:
+            if id in self.meals.keys():  # the key exists in collection
+                d = self.meals[id]
+                del self.meals[id]
+                del self.ids[bisect.bisect_left(self.ids, id)]
+                del self.names[d["name"]]
+                self.version += 1
+                self.unindexMeal(d)
+                logger.debug("MealCollection: deleted meal %s with id %s", d, id)
+                return True, id
+            else:
+                return False, None  # the key does not exist in the collection
 
+    @synced
     def findMealID(self, id):
         """ Given a meal ID, find the resulting collection
 
         :params: the ID of the meal to find
         :returns: True if found, False if not
         """
-        if id in self.meals.keys():  # the key exists in collection
-            d = self.meals[id]
-            print("MealCollection: found meal ", d, " with id ", id)
+        d = self.meals.get(id)
+        if d is not None:  # the key exists in collection
+            logger.debug("MealCollection: found meal %s with id %s", d, id)
             return True, d
         else:
-            print("MealCollection: did not find id", id)
+            logger.debug("MealCollection: did not find id %s", id)
             return False, None  # the key does not exist in the collection
 
+    @journaled
     def delMealName(self, name):
         """ Given a meal name, delete the meal
 
@@ -270,21 +532,23 @@ class MealCollection:
         :returns: True if successfully deleted (and its ID), False if not
         """
 
-        id_to_delete = None
-        for id, meal in self.meals.items(): # search for the meal ID given the name
-            if meal["name"] == name:
-                id_to_delete = id
-                break
-
-        # Delete dish from dictionary by key
-        if id_to_delete is not None:
-            del self.meals[id_to_delete]
-            print("MealCollection: deleted meal with name ", name)
-            return True, id_to_delete
-        else:
-            print("MealCollection: did not find meal_name ", name)
-            return False, None
+        with self.lock:
+            id_to_delete = self.names.get(name) # search for the meal ID given the name
+
+            # Delete dish from dictionary by key
+            if id_to_delete is not None:
+                self.unindexMeal(self.meals[id_to_delete])
+                del self.meals[id_to_delete]
+                del self.ids[bisect.bisect_left(self.ids, id_to_delete)]
+                del self.names[name]
+                self.version += 1
+                logger.debug("MealCollection: deleted meal with name %s", name)
+                return True, id_to_delete
+            else:
+                logger.debug("MealCollection: did not find meal_name %s", name)
+                return False, None
 
+    @synced
     def findMealName(self, name):
         """Returns a single JSON object of the meal specified by its name
 
@@ -292,46 +556,59 @@ class MealCollection:
          return: value of the meal
          """
 
-        fetch_id = None
-        for id, meal in self.meals.items(): # search for the meal ID given the name
-            if meal["name"] == name:
-                fetch_id = id
-                break
+        fetch_id = self.names.get(name) # search for the meal ID given the name
+        d = self.meals.get(fetch_id)  # None as well if deleted since the name was looked up
 
-        if fetch_id is not None:  # Return meal from dictionary by key
-            print("MealCollection: found meal ", self.meals[fetch_id], " with id ", fetch_id)
-            return True, self.meals[fetch_id]
+        if d is not None:  # Return meal from dictionary by key
+            logger.debug("MealCollection: found meal %s with id %s", d, fetch_id)
+            return True, d
         else:
-            print("MealCollection: did not find meal_name ", name)
+            logger.debug("MealCollection: did not find meal_name %s", name)
             return False, None  # the key does not exist in the collection
 
+    @journaled
     def replaceMeal(self, id, meal_name, appetizer_id, main_id, dessert_id, disheColl):
         """ Given a meal ID, replaces the meal components with the new meal name and component IDs
 
         :params: ID of meal to replace and new components (name and IDs)
-        :returns: True  and ID if updated, False and None if meal was not in collection
+        :returns: True  and ID if updated, False and None if meal was not in collection,
+                  False and -2 if the new name belongs to another meal, False and -6 if one of the dishes was deleted meanwhile
         """
 
-        if id in self.meals.keys():  # the key exists in collection
-            self.meals[id] = {
-                "name": meal_name,
-                "ID": id,
-                "appetizer": appetizer_id,
-                "main": main_id,
-                "dessert": dessert_id,
-                "cal": sum(cal for cal in [disheColl.dishes[appetizer_id]["cal"], disheColl.dishes[main_id]["cal"],
-                                           disheColl.dishes[dessert_id]["cal"]]),
-                "sodium": sum(sodium for sodium in
-                              [disheColl.dishes[appetizer_id]["sodium"], disheColl.dishes[main_id]["sodium"],
-                               disheColl.dishes[dessert_id]["sodium"]]),
-                "sugar": sum(sugar for sugar in
-                             [disheColl.dishes[appetizer_id]["sugar"], disheColl.dishes[main_id]["sugar"],
-                              disheColl.dishes[dessert_id]["sugar"]])
-            }
-            print("MealCollection: New meal for id ", id, " is ", self.meals[id])
-
-            return True, id
-
-        else:  # the key does not exist in the collection
-            print("MealCollection: did not find id", id)
-            return False, None
+        with self.lock:
+            if id in self.meals.keys():  # the key exists in collection
+
+                owner = self.names.get(meal_name)
+                if owner is not None and owner != id: # another meal already has this name
+                    logger.debug("MealCollection: meal %s already exists", meal_name)
+                    return False, -2
+
+                # a dish deleted after this point has its meals updated once the lock is released
+                dishes = [disheColl.dishes.get(dish_id) for dish_id in [appetizer_id, main_id, dessert_id]]
+                if None in dishes:
+                    logger.debug("MealCollection: a dish of meal %s was deleted", meal_name)
+                    return False, -6
+
+                del self.names[self.meals[id]["name"]] # re-point the name index at the new name
+                self.names[meal_name] = id
+                self.unindexMeal(self.meals[id])
+
+                self.meals[id] = {
+                    "name": meal_name,
+                    "ID": id,
+                    "appetizer": appetizer_id,
+                    "main": main_id,
+                    "dessert": dessert_id,
+                    "cal": sum(dish["cal"] for dish in dishes),
+                    "sodium": sum(dish["sodium"] for dish in dishes),
+                    "sugar": sum(dish["sugar"] for dish in dishes)
+                }
+                self.indexMeal(self.meals[id])
+                self.version += 1
+                logger.debug("MealCollection: New meal for id %s is %s", id, self.meals[id])
+
+                return True, id
+
+            else:  # the key does not exist in the collection
+                logger.debug("MealCollection: did not find id %s", id)
+                return False, None
@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from store import journal, journaled, synced
+
+logger = logging.getLogger(__name__)
+
+
+class JobCollection:
+    """ JobCollection runs dish creations in the background and stores their outcome
+        Each job is stored in an ordered dictionary with a unique numerical key called id,
+        and a value of the following: ID, dish name, status (pending, done or failed),
+        dish ID once done, error code once failed
+        With a journal the jobs are shared by all processes like the dishes and meals: a job runs in the
+        process which received it, and its creation and outcome are recorded in the journal
+    """
+
+    def __init__(self, workers=4, max_jobs=10000, journal=None):
+        """ Initialize the worker pool
+        :param workers: number of dish creations running at the same time
+        :param max_jobs: number of jobs kept before the oldest finished ones are forgotten
+        :param journal: Journal sharing the jobs with other processes, None to keep them in this process
+        """
+
+        self.opNum = 0
+        self.jobs = OrderedDict()
+        self.max_jobs = max_jobs
+
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+
+        self.journal = journal
+        if journal is not None:
+            journal.register("jobs", self)
+
+    def submit(self, dish_name, insert):
+        """ Queue the creation of a dish
+        :param dish_name: name of the dish to create
+        :param insert: function creating the dish, returning its ID or an error code
+        :return: ID of the new job
+        """
+
+        id = self.addJob(dish_name)
+        self.executor.submit(self.run, id, dish_name, insert)
+        logger.debug("JobCollection: queued job %s for dish %s", id, dish_name)
+        return id
+
+    @journaled
+    def addJob(self, dish_name):
+        """ Store a new pending job
+        :param dish_name: name of the dish to create
+        :return: ID of the new job
+        """
+
+        with self.lock:
+            self.opNum += 1
+            self.jobs[self.opNum] = {"ID": self.opNum, "name": dish_name, "status": "pending", "dish": None, "error": None}
+            self.prune()
+            return self.opNum
+
+    def run(self, id, dish_name, insert):
+        """ Create the dish of a job and record the outcome """
+
+        try:
+            code = insert(dish_name)
+        except Exception as e:
+            logger.warning("JobCollection: job %s raised %s", id, e)
+            code = -4
+
+        self.finishJob(id, code)
+
+    @journaled
+    def finishJob(self, id, code):
+        """ Record the outcome of a job
+        :param id: the ID of the job
+        :param code: ID of the new dish, or error code
+        """
+
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None:  # forgotten meanwhile
+                return
+            if code > 0:
+                self.jobs[id] = dict(job, status="done", dish=code)
+            else:  # -2 already exists, -3 not recognized, -4 not reachable
+                self.jobs[id] = dict(job, status="failed", error=code)
+
+    def prune(self):
+        """ Forget the oldest finished jobs once more than max_jobs are stored """
+
+        for id in list(self.jobs.keys()):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[id]["status"] != "pending":
+                del self.jobs[id]
+
+    @synced
+    def findJobID(self, id):
+        """ Return a copy of the job specified by its ID
+        :param id: the ID of the job
+        :return: True and the job if found, False and None if not
+        """
+
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None:
+                return False, None
+            return True, dict(job)
+
+
+# create JobCollection instance with global scope, configured from the environment
+jobColl = JobCollection(
+    workers=int(os.environ.get("JOB_WORKERS", 4)),
+    max_jobs=int(os.environ.get("JOB_MAX_JOBS", 10000)),
+    journal=journal
+)
@@ -1,7 +1,16 @@
-from model import Dishes, DishesID, DishesName, Meals, MealsID, MealsName
+import logging
+import os
+from model import Dishes, DishesBatch, DishesID, DishesName, JobsID, Meals, MealsID, MealsName, dishColl, mealColl
+from metrics import UPSTREAM_LATENCY, instrument, registry
+from nutrition import nutrition_cache, nutrition_client
 from flask import Flask
 from flask_restful import Api
 
+# Log at LOG_LEVEL (WARNING by default, so the per-request debug logging stays off in the hot path)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+logger = logging.getLogger(__name__)
+
 """ 
 This RESTful API allows users to:
 - Create and store dishes
@@ -19,12 +28,18 @@ api = Api(app)
 # Associate the Resource /dishes with the Dishes class
 api.add_resource(Dishes, '/dishes')
 
+# Associate the Resource /dishes:batch with the DishesBatch class
+api.add_resource(DishesBatch, '/dishes:batch')
+
 # Associate the Resource /dishes/ID with the DishesID class
 api.add_resource(DishesID, '/dishes/<int:id>')
 
 # Associate the Resource /dishes/ID with the DishesName class
 api.add_resource(DishesName, '/dishes/<string:name>')
 
+# Associate the Resource /jobs/ID with the JobsID class
+api.add_resource(JobsID, '/jobs/<int:id>')
+
 # Associate the Resource /meals with the Meals class
 api.add_resource(Meals, '/meals')
 
@@ -34,10 +49,21 @@ api.add_resource(MealsID, '/meals/<int:id>')
 # Associate the Resource /meals/ID with the MealsName class
 api.add_resource(MealsName, '/meals/<string:name>')
 
+# Expose /metrics: request counts and latencies per Resource class and method, upstream call latencies,
+# collection sizes and nutrition cache counters
+instrument(app)
+nutrition_client.listeners.append(
+    lambda latency: UPSTREAM_LATENCY.observe(latency, upstream="api-ninjas", operation="nutrition"))
+registry.callback("collection_size", "Number of documents in each collection", ["collection"],
+                  lambda: {("dishes",): len(dishColl.dishes), ("meals",): len(mealColl.meals)})
+registry.callback("nutrition_cache_events_total", "Nutrition cache hits, misses and evictions", ["event"],
+                  lambda: {(event,): count for event, count in nutrition_cache.stats().items() if event in ("hits", "misses", "evictions")},
+                  type="counter")
 
 
 if __name__ == '__main__':
 
-    print("running main.py")
+    logger.info("running main.py")
 
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # the debugger and reloader only when FLASK_DEBUG is set, gunicorn (see gunicorn.conf.py) serves in production
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8000)), debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true'))
\ No newline at end of file
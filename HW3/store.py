@@ -0,0 +1,204 @@
+import functools
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX systems, where the collections can only be kept in one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+"""
+Sharing of the dishes, meals and jobs collections by several processes (gunicorn workers), enabled with STORE_JOURNAL:
+- every change to a collection is appended to a journal file, as the collection method and its arguments
+- each process keeps its own copy of the collections, and applies the changes appended by the other processes
+  before each read and each change. The journal is mapped in memory, so checking for new changes is a memory
+  read and not a round trip to another process
+- changes are appended under an exclusive lock on the file, after the process applied all the changes before
+  them, so the IDs are given in the same order everywhere, and every process ends with the same collections
+STORE_JOURNAL is the path of the file, e.g. /dev/shm/meals.journal to keep it in memory. An existing journal is
+replayed on start, delete the file to start with empty collections. The journal is never compacted.
+"""
+
+STORE_JOURNAL = os.environ.get("STORE_JOURNAL", "")
+
+# header of the journal file: end of the committed records, instance token. The records start at DATA,
+# each as its length followed by the JSON list [collection, method, arguments]
+HEADER = struct.Struct("<Q8s")
+LENGTH = struct.Struct("<I")
+DATA = 64
+
+
+class Journal:
+    """ Journal shares the changes to the collections between processes, through an append-only file
+        mapped in memory by every process. Each record is committed by advancing the end offset in
+        the header, after the record is written, so readers never see a record partially written.
+    """
+
+    def __init__(self, path, size=1 << 20):
+        """ Initialize the journal, the file is created on first use
+        :param path: path of the journal file
+        :param size: initial size of the file, which doubles whenever it is full
+        """
+
+        if fcntl is None:
+            raise RuntimeError("STORE_JOURNAL requires file locks (fcntl), which this system does not have")
+
+        self.path = path
+        self.size = size
+
+        # collections registered with their name, and the offset after the last record applied to them
+        self.collections = {}
+        self.offset = DATA
+
+        # the file is opened and mapped by each process, the descriptor of the parent is not used after a fork
+        self.fd, self.map, self.pid = None, None, None
+        self.lock = threading.Lock()
+
+    def register(self, name, collection):
+        """ Register a collection whose changes go through the journal
+        :param name: name of the collection in the records
+        :return: the instance token of the journal, which identifies its content in ETags
+        """
+
+        self.collections[name] = collection
+        with self.lock:
+            self.open()
+            return HEADER.unpack_from(self.map)[1].decode()
+
+    def open(self):
+        """ Open and map the journal file in this process, creating it if needed. Called with self.lock held """
+
+        if self.pid == os.getpid():
+            return
+
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < DATA:  # new journal
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, HEADER.pack(DATA, uuid.uuid4().hex[:8].encode()), 0)
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.pid = os.getpid()
+        logger.info("Journal: opened %s", self.path)
+
+    def end(self):
+        """ Return the end offset of the committed records """
+
+        return HEADER.unpack_from(self.map)[0]
+
+    def remap(self, end):
+        """ Map the file again if it grew past the current mapping, to read or write up to end """
+
+        if end > len(self.map):
+            # the former mapping is not closed: sync() reads the header without the lock, and may still be
+            # using it. It is unmapped once the last reference to it is dropped
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+
+    def sync(self):
+        """ Apply the changes appended by other processes to the collections of this process """
+
+        if self.pid == os.getpid() and self.offset == self.end():  # nothing new, without taking the lock
+            return
+
+        with self.lock:
+            self.open()
+            self.replay()
+
+    def replay(self):
+        """ Apply the committed records not applied yet. Called with self.lock held """
+
+        end = self.end()
+        self.remap(end)
+        while self.offset < end:
+            [length] = LENGTH.unpack_from(self.map, self.offset)
+            start = self.offset + LENGTH.size
+            name, method, args = json.loads(self.map[start:start + length])
+            self.offset = start + length
+
+            collection = self.collections[name]
+            try:
+                getattr(collection, method).__wrapped__(collection, *self.decode(args))
+            except Exception:  # it failed in the process which made the change as well
+                logger.exception("Journal: could not apply %s.%s%s", name, method, args)
+
+    def write(self, collection, method, args):
+        """ Make a change to a collection, in the same order in every process
+        :param collection: the registered collection
+        :param method: name of the method making the change
+        :param args: arguments of the method
+        :return: the result of the method
+        """
+
+        name = next(name for name, registered in self.collections.items() if registered is collection)
+        record = json.dumps([name, method, self.encode(args)]).encode()
+
+        with self.lock:
+            self.open()
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                # apply the changes of the other processes first, so this one applies to the same collections
+                self.replay()
+
+                start = self.offset + LENGTH.size
+                if start + len(record) > len(self.map):  # full, double the size of the file
+                    os.ftruncate(self.fd, max(2 * len(self.map), start + len(record)))
+                    self.remap(start + len(record))
+
+                LENGTH.pack_into(self.map, self.offset, len(record))
+                self.map[start:start + len(record)] = record
+                self.offset = start + len(record)
+                struct.pack_into("<Q", self.map, 0, self.offset)  # commit
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+            # applied under self.lock, so no record of another process is applied before it here
+            return getattr(collection, method).__wrapped__(collection, *args)
+
+    def encode(self, args):
+        """ Replace the registered collections in arguments by their name """
+
+        names = {id(registered): name for name, registered in self.collections.items()}
+        return [{"collection": names[id(arg)]} if id(arg) in names else arg for arg in args]
+
+    def decode(self, args):
+        """ Replace the collection names in arguments by the registered collections """
+
+        return [self.collections[arg["collection"]] if isinstance(arg, dict) and list(arg) == ["collection"] else arg
+                for arg in args]
+
+
+def journaled(method):
+    """ Decorator of the collection methods making changes, which go through the journal if the collection has one """
+
+    @functools.wraps(method)
+    def change(self, *args):
+        if self.journal is None:
+            return method(self, *args)
+        return self.journal.write(self, method.__name__, args)
+
+    return change
+
+
+def synced(method):
+    """ Decorator of the collection methods reading it, which first apply the changes made by other processes """
+
+    @functools.wraps(method)
+    def read(self, *args, **kwargs):
+        if self.journal is not None:
+            self.journal.sync()
+        return method(self, *args, **kwargs)
+
+    return read
+
+
+# create Journal instance with global scope if the journal file is configured
+journal = Journal(STORE_JOURNAL) if STORE_JOURNAL else None
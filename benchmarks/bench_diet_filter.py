@@ -0,0 +1,111 @@
+""" Benchmark of the diet filter of GET /meals?diet= with a large number of meals
+
+Times the former approach (retrieve every meal, then filter cal/sodium/sugar in Python)
+against the HW2 $lte query backed by the compound (cal, sodium, sugar) index.
+
+Seeds a separate "bench_diet" database, which is dropped at the end.
+Usage: python benchmarks/bench_diet_filter.py [size]
+Environment: MONGO_URI (default mongodb://127.0.0.1:27017/)
+"""
+
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://127.0.0.1:27017/")
+
+# a strict diet matching a few meals and a loose one matching most of them
+DIETS = [
+    {"name": "strict", "cal": 300, "sodium": 150, "sugar": 30},
+    {"name": "loose", "cal": 1200, "sodium": 400, "sugar": 60},
+]
+
+
+def dishValues(count=200):
+    """ Nutrition values of count dishes, the same on every run """
+
+    rng = random.Random(0)
+    return [
+        {"cal": rng.uniform(20, 500), "size": 100, "sodium": rng.uniform(0, 150), "sugar": rng.uniform(0, 25)}
+        for _ in range(count)
+    ]
+
+
+def filterInPython(meals, diet):
+    """ The former filter of Meals.get: every meal is checked in Python """
+
+    return [
+        meal for meal in meals
+        if meal["cal"] is not None and meal["sodium"] is not None and meal["sugar"] is not None
+        and meal["cal"] <= diet["cal"] and meal["sodium"] <= diet["sodium"] and meal["sugar"] <= diet["sugar"]
+    ]
+
+
+def timeIt(fn, number):
+    """ Return the median duration of number calls of fn, and its last result """
+
+    durations = []
+    for _ in range(number):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2], result
+
+
+def benchMongo(size, number=3):
+    import pymongo
+    sys.path.insert(0, ROOT)
+    from HW2.meals.collection import findPage
+
+    client = pymongo.MongoClient(MONGO_URI)
+    client.drop_database("bench_diet")
+    meals = client["bench_diet"]["meals"]
+    meals.create_index("ID", unique=True)
+    meals.create_index([("cal", pymongo.ASCENDING), ("sodium", pymongo.ASCENDING), ("sugar", pymongo.ASCENDING)])
+
+    values = dishValues()
+    rng = random.Random(1)
+    start = time.perf_counter()
+    batch = []
+    for id in range(1, size + 1):
+        courses = [rng.randrange(len(values)) for _ in range(3)]
+        meal = {"name": f"meal {id}", "appetizer": courses[0] + 1, "main": courses[1] + 1, "dessert": courses[2] + 1}
+        for field in ["cal", "sodium", "sugar"]:
+            meal[field] = sum(values[course][field] for course in courses)
+        meal["ID"], meal["_id"] = id, id
+        batch.append(meal)
+        if len(batch) == 10000:
+            meals.insert_many(batch)
+            batch = []
+    if batch:
+        meals.insert_many(batch)
+    print(f"seeded {size} meals in {time.perf_counter() - start:.1f}s")
+
+    def retrieveAll():
+        """ The former retrieveAllMeals: every document is copied without its _id """
+
+        meals_list = []
+        for meal in meals.find():
+            meal_copy = meal.copy()
+            del meal_copy["_id"]
+            meals_list.append(meal_copy)
+        return meals_list
+
+    print(f"{'diet':>8} {'matches':>10} {'python filter':>15} {'$lte query':>12}")
+    for diet in DIETS:
+        query = {field: {"$lte": diet[field]} for field in ["cal", "sodium", "sugar"]}
+        old, expected = timeIt(lambda: filterInPython(retrieveAll(), diet), number)
+        new, found = timeIt(lambda: findPage(meals, query)[0], number)
+        assert [meal["ID"] for meal in expected] == [meal["ID"] for meal in found]
+        print(f"{diet['name']:>8} {len(found):>10} {old * 1000:>13.1f}ms {new * 1000:>10.1f}ms")
+
+    client.drop_database("bench_diet")
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    benchMongo(size)
@@ -0,0 +1,73 @@
+""" Benchmark of POST /meals on the HW2 meals-service as the number of dishes grows
+
+Seeds the dishes collection directly in MongoDB with a growing number of dishes, then
+times POST /meals requests that reference three of them. With the indexed existence
+check the latency should stay flat in the dish count.
+
+Requires the HW2 compose topology to be running.
+Usage: python benchmarks/bench_meals_post.py [sizes...]
+Environment: MEALS_URL (default http://127.0.0.1:5001), MONGO_URI (default mongodb://127.0.0.1:27017/)
+"""
+
+import json
+import os
+import sys
+import time
+
+import pymongo
+import requests
+
+MEALS_URL = os.environ.get("MEALS_URL", "http://127.0.0.1:5001")
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://127.0.0.1:27017/")
+HEADERS = {"Content-Type": "application/json"}
+
+# IDs of the seeded dishes start high to stay clear of dishes created through the API
+FIRST_ID = 10_000_000
+
+
+def seed(dishes, size):
+    """ Make sure the dishes collection holds at least size seeded dishes """
+
+    present = dishes.count_documents({"ID": {"$gte": FIRST_ID}})
+    batch = []
+    for id in range(FIRST_ID + present, FIRST_ID + size):
+        batch.append({"name": f"bench dish {id}", "cal": 100, "size": 100, "sodium": 10, "sugar": 1, "ID": id, "_id": id})
+        if len(batch) == 10000:
+            dishes.insert_many(batch)
+            batch = []
+    if batch:
+        dishes.insert_many(batch)
+
+
+def timePosts(session, size, number):
+    """ Time number POST /meals requests referencing the last three seeded dishes """
+
+    latencies = []
+    for i in range(number):
+        meal = {"name": f"bench meal {size}-{i}", "appetizer": FIRST_ID + size - 1,
+                "main": FIRST_ID + size - 2, "dessert": FIRST_ID + size - 3}
+        start = time.perf_counter()
+        response = session.post(f"{MEALS_URL}/meals", headers=HEADERS, data=json.dumps(meal))
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 201, response.text
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(sizes, number=200):
+    db = pymongo.MongoClient(MONGO_URI)["nutrition"]
+    session = requests.Session()
+
+    print(f"{'dishes':>10} {'p50':>10} {'p99':>10}")
+    for size in sizes:
+        seed(db["dishes"], size)
+        p50, p99 = timePosts(session, size, number)
+        print(f"{size:>10} {p50 * 1000:>8.2f}ms {p99 * 1000:>8.2f}ms")
+
+    # remove the seeded dishes and the meals created by the benchmark
+    db["dishes"].delete_many({"ID": {"$gte": FIRST_ID}})
+    db["meals"].delete_many({"name": {"$regex": "^bench meal "}})
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,57 @@
+""" Benchmark of the by-name operations of the HW3 in-memory collections
+
+Seeds DishCollection and MealCollection with a growing number of entries and times
+the duplicate checks (insertDish / insertMeal with an existing name) and the
+by-name lookups. With the name index the per-call latency should stay flat as the
+collection grows.
+
+Usage: python benchmarks/bench_name_index.py [sizes...]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HW3"))
+
+from collection import DishCollection, MealCollection
+from nutrition import NutritionProvider
+
+
+class _FixedProvider(NutritionProvider):
+    """ Stand-in nutrition provider so seeding does not hit the network """
+
+    def lookup(self, query):
+        return 0, {"cal": 100, "size": 100, "sodium": 10, "sugar": 1}
+
+
+def seed(size):
+    """ Create size dishes and size meals """
+
+    dishes, meals = DishCollection(provider=_FixedProvider()), MealCollection()
+    for i in range(size):
+        dishes.insertDish(f"dish {i}")
+    for i in range(size):
+        meals.insertMeal(f"meal {i}", 1, 1, 1, dishes)
+    return dishes, meals
+
+
+def main(sizes):
+    print(f"{'size':>8} {'insertDish dup':>16} {'findDishName':>14} {'insertMeal dup':>16} {'findMealName':>14}")
+    for size in sizes:
+        dishes, meals = seed(size)
+        last_dish, last_meal = f"dish {size - 1}", f"meal {size - 1}"
+
+        number = 10000
+        timings = [
+            timeit.timeit(lambda: dishes.insertDish(last_dish), number=number),
+            timeit.timeit(lambda: dishes.findDishName(last_dish), number=number),
+            timeit.timeit(lambda: meals.insertMeal(last_meal, 1, 1, 1, dishes), number=number),
+            timeit.timeit(lambda: meals.findMealName(last_meal), number=number),
+        ]
+        us = [t / number * 1e6 for t in timings]
+        print(f"{size:>8} {us[0]:>14.2f}us {us[1]:>12.2f}us {us[2]:>14.2f}us {us[3]:>12.2f}us")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 50000])
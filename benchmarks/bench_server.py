@@ -0,0 +1,121 @@
+""" Benchmark of the HW3 app under the Flask development server and under gunicorn, in one process and in
+four worker processes sharing the collections through a journal (STORE_JOURNAL)
+
+Starts the app from HW3 under each server in turn, seeds dishes from the bundled food table
+(NUTRITION_PROVIDER=local, so no request leaves the machine), then measures the throughput and
+latency of GET /dishes and POST /meals with concurrent clients over keep-alive connections.
+
+Usage: python benchmarks/bench_server.py [requests] [clients]
+Environment: GUNICORN_THREADS (default 8) for the gunicorn runs
+"""
+
+import csv
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HW3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HW3")
+HEADERS = {"Content-Type": "application/json"}
+
+JOURNAL = os.path.join(tempfile.gettempdir(), "bench_server.journal")
+
+# command and environment of each server
+SERVERS = {
+    "flask run": ([sys.executable, "-m", "flask", "--app", "main", "run", "--port", "{port}"], {}),
+    "gunicorn": ([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "main:app"], {}),
+    "gunicorn x4": ([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "main:app"],
+                    {"GUNICORN_WORKERS": "4", "STORE_JOURNAL": JOURNAL}),
+}
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(command, env, port):
+    """ Start a server in HW3 and wait until it answers """
+
+    env = dict(os.environ, PORT=str(port), NUTRITION_PROVIDER="local", LOG_LEVEL="WARNING", **env)
+    server = subprocess.Popen([arg.format(port=port) for arg in command], cwd=HW3, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/dishes?limit=1", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{command[2]} did not start")
+
+
+def seed(url):
+    """ Add the dishes of the food table, return their IDs """
+
+    with open(os.path.join(HW3, "nutrition.csv")) as f:
+        names = [row["name"] for row in csv.DictReader(f)]
+    return [requests.post(url + "/dishes", json={"name": name}, headers=HEADERS).json() for name in names]
+
+
+def run(count, clients, request):
+    """ Send count requests from clients threads, each with its own session
+    :return: requests per second and the sorted latencies
+    """
+
+    def worker(indexes):
+        session = requests.Session()
+        latencies = []
+        for i in indexes:
+            started = time.perf_counter()
+            response = request(session, i)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code in (200, 201), response.status_code
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = sorted(l for ls in executor.map(worker, [range(c, count, clients) for c in range(clients)]) for l in ls)
+    return count / (time.perf_counter() - started), latencies
+
+
+def report(server, operation, rate, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{server:12} {operation:12} {rate:8.0f} req/s   p50 {p50:6.1f}ms   p99 {p99:6.1f}ms")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    for name, (command, env) in SERVERS.items():
+        if os.path.exists(JOURNAL):
+            os.remove(JOURNAL)
+        port = freePort()
+        server = start(command, env, port)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            ids = seed(url)
+            rate, latencies = run(count, clients, lambda s, i: s.get(url + "/dishes"))
+            report(name, "GET /dishes", rate, latencies)
+
+            meal = lambda i: {"name": f"meal {i}", "appetizer": ids[i % len(ids)], "main": ids[(i + 1) % len(ids)],
+                              "dessert": ids[(i + 2) % len(ids)]}
+            rate, latencies = run(count, clients, lambda s, i: s.post(url + "/meals", json=meal(i), headers=HEADERS))
+            report(name, "POST /meals", rate, latencies)
+        finally:
+            server.terminate()
+            server.wait()
+            if os.path.exists(JOURNAL):
+                os.remove(JOURNAL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HW3"))
+
+from collection import DishCollection, MealCollection, Snapshot
+from jobs import JobCollection
+import store
+from store import Journal
+
+## Stress tests of the HW3 collections: many threads change and read them at the same time,
+## run with "python -m pytest tests/hw3_concurrency_tests.py" (no server needed)
+
+THREADS = 16
+TOTALS = {"cal": 100, "size": 100, "sodium": 10, "sugar": 1}
+
+
+def run(count, task):
+    """ Run task(i) for i in range(count) on THREADS threads, started together and switching often """
+
+    barrier = threading.Barrier(THREADS)
+
+    def worker(indexes):
+        barrier.wait()
+        return [task(i) for i in indexes]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = executor.map(worker, [range(t, count, THREADS) for t in range(THREADS)])
+            return [result for results_of_thread in results for result in results_of_thread]
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def check_indexes(dishColl, mealColl):
+    """ The name, ID and reference indexes agree with the collections """
+
+    assert dishColl.names == {dish["name"]: id for id, dish in dishColl.dishes.items()}
+    assert dishColl.ids == sorted(dishColl.dishes) and mealColl.ids == sorted(mealColl.meals)
+    assert mealColl.names == {meal["name"]: id for id, meal in mealColl.meals.items()}
+    for dish_id, refs in mealColl.dish_refs.items():
+        for id, course in refs:
+            assert mealColl.meals[id][course] == dish_id
+
+
+def test_unique_ids():
+    dishColl = DishCollection()
+    ids = run(2000, lambda i: dishColl.addDish(f"dish {i}", TOTALS))
+    assert sorted(ids) == list(range(1, 2001))
+    assert dishColl.opNum == 2000 and len(dishColl.dishes) == 2000
+
+
+def test_same_name_added_once():
+    dishColl = DishCollection()
+    ids = run(800, lambda i: dishColl.addDish(f"dish {i % 50}", TOTALS))
+    assert len([id for id in ids if id > 0]) == 50
+    assert ids.count(-2) == 750
+
+
+def test_snapshots_while_writing():
+    dishColl = DishCollection()
+    done = threading.Event()
+    errors = []
+
+    def reader():
+        while not done.is_set():
+            try:
+                snapshot = dishColl.retrieveAllDishes()
+                assert isinstance(snapshot, Snapshot)
+                # a snapshot holds every dish up to its last ID, and never changes afterwards
+                size = len(snapshot)
+                assert sorted(snapshot) == list(range(1, snapshot.last_id + 1))
+                assert len(snapshot) == size
+                dishColl.retrieveDishes(after=0, limit=10)
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    run(3000, lambda i: dishColl.addDish(f"dish {i}", TOTALS))
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert len(dishColl.retrieveAllDishes()) == 3000
+
+
+def test_snapshot_read_only():
+    dishColl = DishCollection()
+    dishColl.addDish("orange", TOTALS)
+    snapshot = dishColl.retrieveAllDishes()
+    try:
+        snapshot[2] = {}
+        assert False
+    except TypeError:
+        pass
+    assert dishColl.retrieveAllDishes() is snapshot  # nothing changed, no new copy
+
+
+def test_meals_and_dish_deletions():
+    dishColl, mealColl = DishCollection(), MealCollection()
+    dish_ids = [dishColl.addDish(f"dish {i}", TOTALS) for i in range(40)]
+
+    def task(i):
+        if i % 4 == 3:  # delete a dish and update its meals, like DELETE /dishes/ID
+            status, dish_id = dishColl.delDishID(dish_ids[i % len(dish_ids)])
+            if status:
+                mealColl.updateMeals(dish_id)
+            return None
+        a, m, d = (dish_ids[(i + k) % len(dish_ids)] for k in range(3))
+        if not dishColl.checkDishes([a, m, d]):
+            return -6
+        return mealColl.insertMeal(f"meal {i}", a, m, d, dishColl)
+
+    results = run(4000, task)
+    meal_ids = [id for id in results if id is not None and id > 0]
+    assert sorted(meal_ids) == sorted(mealColl.meals)
+    assert len(set(meal_ids)) == len(meal_ids)
+
+    # every meal referencing a deleted dish has it nulled out, with no components
+    for meal in mealColl.meals.values():
+        courses = [meal[course] for course in ["appetizer", "main", "dessert"]]
+        assert all(dish_id is None or dish_id in dishColl.dishes for dish_id in courses)
+        if None in courses:
+            assert meal["cal"] is None and meal["sodium"] is None and meal["sugar"] is None
+        else:
+            assert meal["cal"] == 3 * TOTALS["cal"]
+    check_indexes(dishColl, mealColl)
+
+
+def test_replace_and_delete_meals():
+    dishColl, mealColl = DishCollection(), MealCollection()
+    dish_ids = [dishColl.addDish(f"dish {i}", dict(TOTALS, cal=i)) for i in range(10)]
+    for i in range(200):
+        mealColl.insertMeal(f"meal {i}", dish_ids[0], dish_ids[1], dish_ids[2], dishColl)
+    held = mealColl.findMealID(1)[1]
+
+    def task(i):
+        id = i % 200 + 1
+        if i % 3 == 0:
+            mealColl.delMealID(id)
+        else:
+            mealColl.replaceMeal(id, f"meal {id} v{i}", dish_ids[i % 10], dish_ids[(i + 1) % 10], dish_ids[(i + 2) % 10], dishColl)
+        return mealColl.retrieveAllMeals()
+
+    snapshots = run(2000, task)
+    assert held == {"name": "meal 0", "ID": 1, "appetizer": dish_ids[0], "main": dish_ids[1], "dessert": dish_ids[2],
+                    "cal": 3, "sodium": 30, "sugar": 3}  # a meal object is replaced, never changed
+    assert all(isinstance(snapshot, Snapshot) for snapshot in snapshots)
+    check_indexes(dishColl, mealColl)
+
+
+def test_processes_share_journal(tmp_path):
+    path = str(tmp_path / "journal")
+    queue = multiprocessing.get_context("fork").Queue()
+
+    def worker(p):
+        journal = Journal(path, size=4096)  # small, so that the file grows while the others read it
+        dishColl, mealColl = DishCollection(journal=journal), MealCollection(journal=journal)
+        dish_ids = run(100, lambda i: dishColl.addDish(f"dish {p} {i}", TOTALS))
+        meal_ids = run(50, lambda i: mealColl.insertMeal(f"meal {p} {i}", dish_ids[i], dish_ids[i + 1], dish_ids[i + 2], dishColl))
+        queue.put((dish_ids, meal_ids))
+
+    processes = [multiprocessing.get_context("fork").Process(target=worker, args=(p,)) for p in range(4)]
+    for process in processes:
+        process.start()
+    results = [queue.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join()
+
+    # IDs are unique across the processes, and a new process replays the same collections
+    assert sorted(id for dish_ids, _ in results for id in dish_ids) == list(range(1, 401))
+    assert sorted(id for _, meal_ids in results for id in meal_ids) == list(range(1, 201))
+    journal = Journal(path)
+    dishColl, mealColl = DishCollection(journal=journal), MealCollection(journal=journal)
+    assert len(dishColl.retrieveAllDishes()) == 400 and len(mealColl.retrieveAllMeals()) == 200
+    assert dishColl.etag() == f'"dishes-{dishColl.instance}-400"'
+    check_indexes(dishColl, mealColl)
+
+
+def test_reads_while_journal_grows(tmp_path, monkeypatch):
+    # mapping the file again is slowed down, so that readers run while the journal grows
+    mapFile = store.mmap.mmap
+
+    def slowMapFile(*args):
+        time.sleep(0.001)
+        return mapFile(*args)
+
+    monkeypatch.setattr(store.mmap, "mmap", slowMapFile)
+    dishColl = DishCollection(journal=Journal(str(tmp_path / "journal"), size=4096))
+    done = threading.Event()
+    errors = []
+
+    def reader():
+        while not done.is_set():
+            try:
+                dishColl.etag()
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in readers:
+        thread.start()
+    for i in range(2000):
+        dishColl.addDish(f"dish {i}", TOTALS)
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert dishColl.etag() == f'"dishes-{dishColl.instance}-2000"'
+
+
+def test_jobs_share_journal(tmp_path):
+    # two job collections on their own journal objects, as in two processes
+    first, second = (JobCollection(workers=2, journal=Journal(str(tmp_path / "journal"))) for _ in range(2))
+    ids = run(40, lambda i: (first if i % 2 else second).submit(f"dish {i}", lambda name: -3 if i % 5 == 0 else i + 1))
+    assert sorted(ids) == list(range(1, 41))
+    for jobs in (first, second):
+        jobs.executor.shutdown(wait=True)
+
+    for id in ids:
+        found = [jobs.findJobID(id) for jobs in (first, second)]
+        assert found[0] == found[1] and found[0][0] and found[0][1]["status"] != "pending"